@@ -8,6 +8,67 @@ class Config:
     GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
     EMAIL_USER = os.getenv("EMAIL_USER")
     EMAIL_PASS = os.getenv("EMAIL_PASS")
+    #comparison requests python_server runs at the same time
+    MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "20"))
+    #comparisons kept for rescoring with another alpha, and for how many seconds
+    RANKING_SESSIONS_SIZE = int(os.getenv("RANKING_SESSIONS_SIZE", "10000"))
+    RANKING_SESSION_TTL = float(os.getenv("RANKING_SESSION_TTL", "1800"))
+    #carts (or addresses) a single batch request may compare
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+    #python_server processes: above 1 a supervisor routes the requests to that many workers by address
+    PYTHON_WORKERS = int(os.getenv("PYTHON_WORKERS", "1"))
+    #seconds before a crashed worker is started again
+    WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+    #threads that run the blocking MongoDB calls of the comparison pipeline
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+    #entries kept in memory in front of findStores and findPrices
+    STORES_CACHE_SIZE = int(os.getenv("STORES_CACHE_SIZE", "50000"))
+    PRICES_CACHE_SIZE = int(os.getenv("PRICES_CACHE_SIZE", "200000"))
+    #geocoded addresses kept in memory in front of the geocodes collection
+    GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "100000"))
+    #days an address that could not be geocoded is not tried again
+    GEOCODE_NEGATIVE_TTL_DAYS = float(os.getenv("GEOCODE_NEGATIVE_TTL_DAYS", "3"))
+    #adaptive concurrency per upstream (upstream.py), retries of 429/5xx and connection errors
+    CHP_INITIAL_CONCURRENCY = int(os.getenv("CHP_INITIAL_CONCURRENCY", "10"))
+    CHP_MAX_CONCURRENCY = int(os.getenv("CHP_MAX_CONCURRENCY", "40"))
+    CHP_LATENCY_TARGET = float(os.getenv("CHP_LATENCY_TARGET", "3"))
+    DISTANCE_MATRIX_MAX_CONCURRENCY = int(os.getenv("DISTANCE_MATRIX_MAX_CONCURRENCY", "20"))
+    NOMINATIM_MAX_CONCURRENCY = int(os.getenv("NOMINATIM_MAX_CONCURRENCY", "1"))
+    NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL", "1"))
+    UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+    UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+    UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+    #shared HTTP client of the comparison pipeline. the connections per host follow the largest
+    #concurrency cap above, a smaller pool would silently cap the upstream limiter
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+    HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", str(max(CHP_MAX_CONCURRENCY, DISTANCE_MATRIX_MAX_CONCURRENCY))))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+    #external services of the comparison pipeline, benchmarks/ points them at local stand-ins
+    CHP_URL = os.getenv("CHP_URL", "https://chp.co.il")
+    GOOGLE_MAPS_URL = os.getenv("GOOGLE_MAPS_URL", "https://www.google.com")
+    GOOGLE_MAPS_API_URL = os.getenv("GOOGLE_MAPS_API_URL", "https://maps.googleapis.com")
+    NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+    #where the CHP pages are parsed: "process" (a pool of processes, in parallel on every core),
+    #"thread" (keeps the event loop free, the parser holds the GIL) or "inline" (on the event loop)
+    PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "process")
+    #parse processes or threads, 0: one per core
+    PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+    #smaller pages (e.g. "not found") are parsed on the event loop, sending them costs more
+    PARSE_OFFLOAD_MIN_BYTES = int(os.getenv("PARSE_OFFLOAD_MIN_BYTES", "16384"))
+    #price matrices of more cells (stores x products) are scored on a thread
+    SCORE_OFFLOAD_CELLS = int(os.getenv("SCORE_OFFLOAD_CELLS", "100000"))
+    #background refresh of popular (area, product) entries before they expire
+    REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "60"))
+    REFRESH_AHEAD_HOURS = float(os.getenv("REFRESH_AHEAD_HOURS", "6"))
+    REFRESH_MIN_ACCESSES = float(os.getenv("REFRESH_MIN_ACCESSES", "2"))
+    REFRESH_HALF_LIFE_HOURS = float(os.getenv("REFRESH_HALF_LIFE_HOURS", "24"))
+    REFRESH_TRACKED_SIZE = int(os.getenv("REFRESH_TRACKED_SIZE", "20000"))
+    REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "4"))
+    #CHP requests per second the refresher may use, shared with the requests of users; 0 disables it
+    CHP_RATE = float(os.getenv("CHP_RATE", "0.5"))
+    CHP_BURST = float(os.getenv("CHP_BURST", "5"))
 
 if not Config.MONGODB_URI:
     raise RuntimeError("Missing MONGODB_URI in .env")
@@ -1,6 +1,7 @@
 import mongoose from "mongoose"
 import config from "../config.js";
 import FindStores from "../models/FindStores.js";
+import Geocode from "../models/Geocode.js";
 
 let client;
 
@@ -18,6 +19,8 @@ const connectDB = async () => {
       { last_updated: 1 },
       { expireAfterSeconds: 60 * 60 * 24 * 20 } //20 days
     );
+    //the pipeline looks addresses up on every comparison, by address and expiry
+    await Geocode.createIndexes();
 
   } catch (error) {
     console.error(error);
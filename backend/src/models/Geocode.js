@@ -0,0 +1,34 @@
+import mongoose from "mongoose";
+
+//coordinates of the branch addresses, written by the comparison pipeline (geocodeStore.py).
+//an address that could not be geocoded is kept with found: false until it expires
+const GeocodeSchema = new mongoose.Schema(
+  {
+    address: {
+      type: String,
+      required: true,
+    },
+    lat: Number,
+    lon: Number,
+    found: {
+      type: Boolean,
+      required: true,
+    },
+    last_updated: {
+      type: Date,
+      default: Date.now,
+    },
+    expires_at: {
+      type: Date,
+      required: true,
+    },
+  },
+  { versionKey: false }
+);
+
+GeocodeSchema.index({ address: 1 }, { unique: true });
+//every document has its own expiry, found addresses a year, failed ones a few days
+GeocodeSchema.index({ expires_at: 1 }, { expireAfterSeconds: 0 });
+
+const Geocode = mongoose.model("Geocode", GeocodeSchema, "geocodes");
+export default Geocode;
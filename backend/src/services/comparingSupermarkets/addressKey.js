@@ -0,0 +1,79 @@
+//canonical form of an address for cache keys, the same function as addressKey.py
+//(the python server reads and writes the same findStores / notFoundStores documents),
+//change both together
+
+//Hebrew punctuation and look-alikes -> ascii
+const CHARACTERS = {
+  "׳": "'", // geresh
+  "״": '"', // gershayim
+  "‘": "'", "’": "'", "‚": "'", "`": "'", "´": "'",
+  "“": '"', "”": '"', "„": '"',
+  "־": "-", // maqaf
+  "‐": "-", "‑": "-", "‒": "-", "–": "-", "—": "-",
+  " ": " ",
+};
+const CHARACTER_PATTERN = new RegExp(`[${Object.keys(CHARACTERS).join("")}]`, "g");
+//niqqud and cantillation marks
+const MARKS = /[֑-ֽֿ-ׇ]/g;
+//separators that do not change the address
+const SEPARATORS = /[,;.()[\]/\\|:]+/g;
+//hyphen between words (תל-אביב), not between numbers (12-14)
+const WORD_HYPHEN = /(?<=[^\d\s])\s*-\s*|\s*-\s*(?=[^\d\s])/g;
+//"6 א", "6-א", "6'א" -> "6א"
+const HOUSE_LETTER = /(?<=\d)\s*['-]?\s*([א-ת])(?![א-ת])/g;
+//"מס' 6", "מספר 6" -> "6"
+const HOUSE_NUMBER_WORD = /(?<![א-ת])(?:מס'|מספר)\s*(?=\d)/g;
+//street type at the beginning: "רחוב הרצל", "רח' הרצל"
+const STREET_PREFIX = /^(?:רחוב|רח'?)\s+/;
+const COUNTRY_SUFFIX = /\s*(?:ישראל|israel)$/;
+
+//common city spellings and abbreviations -> one name
+const CITY_NAMES = {
+  'ת"א': "תל אביב",
+  'ת"א יפו': "תל אביב",
+  "תל אביב יפו": "תל אביב",
+  'פ"ת': "פתח תקווה",
+  "פתח תקוה": "פתח תקווה",
+  'ר"ג': "רמת גן",
+  'ב"ש': "באר שבע",
+  'ראשל"צ': "ראשון לציון",
+  'ק"ס': "כפר סבא",
+  'נ"צ': "נס ציונה",
+  'ק"ש': "קריית שמונה",
+  "קרית שמונה": "קריית שמונה",
+  "קרית אתא": "קריית אתא",
+  "קרית ביאליק": "קריית ביאליק",
+  "קרית גת": "קריית גת",
+  "קרית מוצקין": "קריית מוצקין",
+  "קרית אונו": "קריית אונו",
+  "קרית ים": "קריית ים",
+  "קרית מלאכי": "קריית מלאכי",
+  "קרית ארבע": "קריית ארבע",
+};
+const CITY_SUFFIX = new RegExp(
+  "(^|\\s)(" +
+    Object.keys(CITY_NAMES)
+      .sort((a, b) => b.length - a.length)
+      .map((name) => name.replace(/[.*+?^${}()|[\]\\]/g, "\\$&"))
+      .join("|") +
+    ")$"
+);
+
+const squeeze = (text) => text.split(/\s+/).filter(Boolean).join(" ");
+
+export function addressKey(address) {
+  if (!address) return "";
+  let key = address
+    .normalize("NFC")
+    .replace(CHARACTER_PATTERN, (c) => CHARACTERS[c]);
+  key = key.replace(MARKS, "").toLowerCase();
+  key = squeeze(key.replace(SEPARATORS, " "));
+
+  key = key.replace(WORD_HYPHEN, " ");
+  key = key.replace(COUNTRY_SUFFIX, "");
+  key = key.replace(CITY_SUFFIX, (_, before, name) => before + CITY_NAMES[name]);
+  key = key.replace(HOUSE_NUMBER_WORD, "");
+  key = key.replace(HOUSE_LETTER, "$1");
+  key = key.replace(STREET_PREFIX, "");
+  return squeeze(key);
+}
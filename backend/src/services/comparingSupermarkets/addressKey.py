@@ -0,0 +1,73 @@
+import re
+import unicodedata
+
+#canonical form of an address for cache keys: "החרמון 6 נתניה", "החרמון 6, נתניה" and
+#"רחוב החרמון 6, נתניה, ישראל" are the same key. addressKey.js is the same function for node,
+#change both together
+
+#Hebrew punctuation and look-alikes -> ascii
+CHARACTERS = str.maketrans({
+    "\u05f3": "'",  # geresh
+    "\u05f4": '"',  # gershayim
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "`": "'", "\u00b4": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"',
+    "\u05be": "-",  # maqaf
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-",
+    "\u00a0": " ",
+})
+#niqqud and cantillation marks
+MARKS = re.compile(r"[\u0591-\u05bd\u05bf-\u05c7]")
+#separators that do not change the address
+SEPARATORS = re.compile(r"[,;.()\[\]/\\|:]+")
+#hyphen between words (תל-אביב), not between numbers (12-14)
+WORD_HYPHEN = re.compile(r"(?<=[^\d\s])\s*-\s*|\s*-\s*(?=[^\d\s])")
+#"6 א", "6-א", "6'א" -> "6א"
+HOUSE_LETTER = re.compile(r"(?<=\d)\s*['-]?\s*([א-ת])(?![א-ת])")
+#"מס' 6", "מספר 6" -> "6"
+HOUSE_NUMBER_WORD = re.compile(r"(?<![א-ת])(?:מס'|מספר)\s*(?=\d)")
+#street type at the beginning: "רחוב הרצל", "רח' הרצל"
+STREET_PREFIX = re.compile(r"^(?:רחוב|רח'?)\s+")
+COUNTRY_SUFFIX = re.compile(r"\s*(?:ישראל|israel)$")
+
+#common city spellings and abbreviations -> one name
+CITY_NAMES = {
+    'ת"א': "תל אביב",
+    'ת"א יפו': "תל אביב",
+    "תל אביב יפו": "תל אביב",
+    'פ"ת': "פתח תקווה",
+    "פתח תקוה": "פתח תקווה",
+    'ר"ג': "רמת גן",
+    'ב"ש': "באר שבע",
+    'ראשל"צ': "ראשון לציון",
+    'ק"ס': "כפר סבא",
+    'נ"צ': "נס ציונה",
+    'ק"ש': "קריית שמונה",
+    "קרית שמונה": "קריית שמונה",
+    "קרית אתא": "קריית אתא",
+    "קרית ביאליק": "קריית ביאליק",
+    "קרית גת": "קריית גת",
+    "קרית מוצקין": "קריית מוצקין",
+    "קרית אונו": "קריית אונו",
+    "קרית ים": "קריית ים",
+    "קרית מלאכי": "קריית מלאכי",
+    "קרית ארבע": "קריית ארבע",
+}
+CITY_SUFFIX = re.compile(
+    r"(?:^|\s)(" + "|".join(re.escape(name) for name in sorted(CITY_NAMES, key=len, reverse=True)) + r")$"
+)
+
+def address_key(address):
+    if not address:
+        return ""
+    key = unicodedata.normalize("NFC", address).translate(CHARACTERS)
+    key = MARKS.sub("", key).lower()
+    key = SEPARATORS.sub(" ", key)
+    key = " ".join(key.split())
+
+    key = WORD_HYPHEN.sub(" ", key)
+    key = COUNTRY_SUFFIX.sub("", key)
+    key = CITY_SUFFIX.sub(lambda m: m.group(0)[:m.start(1) - m.start(0)] + CITY_NAMES[m.group(1)], key)
+    key = HOUSE_NUMBER_WORD.sub("", key)
+    key = HOUSE_LETTER.sub(r"\1", key)
+    key = STREET_PREFIX.sub("", key)
+    return " ".join(key.split())
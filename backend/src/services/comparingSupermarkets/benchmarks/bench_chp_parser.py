@@ -0,0 +1,81 @@
+#parity check and throughput benchmark: BeautifulSoup parse of the whole page vs chpParser
+#the pages in fixtures/ follow the markup of chp.co.il compare_results
+#usage: python benchmarks/bench_chp_parser.py [repeat]
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from chpParser import parse_results_table, parse_discount_text
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+#the parse fetch_store_data used before chpParser
+def soup_parse(html, now):
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table", {"class": "table results-table"})
+    if not table:
+        return None
+
+    stores = {}
+    for row in table.find_all("tr")[1:]:  # skip titles
+        cols = [col.text.strip() for col in row.find_all("td")]
+        if len(cols) >= 4:
+            store_name, address = cols[0], cols[2]
+            regular_price = cols[-1]
+            sale_price = re.sub(r"[^\d.]", "", cols[-2])  # only numbers and "."
+            required_quantity = None
+            discount_button = row.find("button", class_="btn-discount")
+            if discount_button:
+                discount_text = discount_button["data-discount-desc"]
+                required_quantity = parse_discount_text(discount_text)
+
+            stores[(store_name, address)] = {
+                "Regular Price": float(regular_price) if regular_price else None,
+                "Sale Price": float(sale_price) if sale_price else None,
+                "Required Quantity": required_quantity,
+                "Last Updated": now,
+            }
+    return stores
+
+def load_fixtures():
+    pages = {}
+    for name in sorted(os.listdir(FIXTURES)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+                pages[name] = f.read()
+    return pages
+
+def check_parity(pages):
+    now = datetime.now(timezone.utc)
+    for name, html in pages.items():
+        expected = soup_parse(html, now)
+        actual = parse_results_table(html, now)
+        if actual != expected:
+            raise AssertionError(f"{name}: chpParser result differs from the BeautifulSoup parse")
+        print(f"parity ok: {name} ({0 if expected is None else len(expected)} stores)")
+
+def pages_per_second(parse, pages, repeat):
+    now = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages.values():
+            parse(html, now)
+    return repeat * len(pages) / (time.perf_counter() - start)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pages = load_fixtures()
+    check_parity(pages)
+
+    soup_rate = pages_per_second(soup_parse, pages, repeat)
+    fast_rate = pages_per_second(parse_results_table, pages, repeat)
+    print(f"BeautifulSoup: {soup_rate:9.1f} pages/s")
+    print(f"chpParser:     {fast_rate:9.1f} pages/s")
+    print(f"speedup:       {fast_rate / soup_rate:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+#end-to-end throughput of bench_pipeline.py with the CHP pages parsed inline, on threads and on
+#processes (PARSE_EXECUTOR is read when the pipeline is imported, so every executor runs in its own
+#process). the other arguments are passed to bench_pipeline.py.
+#usage: python benchmarks/bench_executor.py [--executors inline,thread,process] [--carts 20,50]
+#       [--branches 100,1000] [bench_pipeline.py arguments]
+import argparse
+import os
+import subprocess
+import sys
+
+BENCH_PIPELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_pipeline.py")
+
+def main():
+    parser = argparse.ArgumentParser(description="bench_pipeline.py once per parse executor")
+    parser.add_argument("--executors", default="inline,thread,process")
+    parser.add_argument("--carts", default="20,50", help="cart sizes")
+    parser.add_argument("--branches", default="100,1000", help="branches in the area")
+    args, rest = parser.parse_known_args()
+
+    for executor in args.executors.split(","):
+        print(f"=== PARSE_EXECUTOR={executor} (cores: {os.cpu_count()})", flush=True)
+        env = {**os.environ, "PARSE_EXECUTOR": executor}
+        subprocess.run(
+            [sys.executable, BENCH_PIPELINE, "--carts", args.carts, "--branches", args.branches, *rest],
+            env=env, check=True,
+        )
+        print(flush=True)
+
+if __name__ == "__main__":
+    main()
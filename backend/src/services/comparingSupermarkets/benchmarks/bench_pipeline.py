@@ -0,0 +1,168 @@
+#end-to-end benchmark of get_best_supermarkets without the network: local stand-ins of CHP,
+#the Distance Matrix and the geocoders (local_services.py), an in-memory database (memory_db.py)
+#and synthetic areas (synthetic.py). for every branch count and cart size it reports:
+#  cold     nothing cached anywhere, every page is fetched
+#  restart  the database is warm but the process caches are empty (a new python_server)
+#  warm     everything cached in memory
+#and the throughput of concurrent requests, cold and warm.
+#usage: python benchmarks/bench_pipeline.py [--carts 1,5,10,20,50] [--branches 10,100,1000]
+#       [--chp-ms 150] [--maps-ms 80] [--geocode-ms 100] [--db-ms 2] [--concurrency 8]
+import argparse
+import asyncio
+import inspect
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+#the db client connects lazily, memory_db answers every read
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+#the local Distance Matrix accepts any key
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "benchmark")
+#the one request per second of the public Nominatim does not apply to the local one
+os.environ.setdefault("NOMINATIM_MIN_INTERVAL", "0")
+os.environ.setdefault("NOMINATIM_MAX_CONCURRENCY", "10")
+from synthetic import World
+from local_services import LocalServices
+
+#the pipeline reads the service URLs when it is imported
+services = LocalServices(None)
+os.environ.update(services.environment())
+
+import importPrices
+import bestBranches
+import geocodeStore
+import httpClient
+import cpuPool
+import spatialIndex
+from memory_db import MemoryDb
+
+#(module, function, stage name): the time spent inside each is added to its stage
+STAGES = [
+    (importPrices, "storesFromDB", "stores_db"),
+    (importPrices, "updateMissingStores", "stores_chp"),
+    (importPrices, "pricesFromDB", "prices_db"),
+    (importPrices, "updateMissingPrices", "prices_chp"),
+    (importPrices, "recommendedToRemove", "recommend"),
+    (bestBranches, "find_cached_distances", "dist_db"),
+    (bestBranches, "get_distances", "dist_calc"),
+    (bestBranches, "rank_supermarkets", "scoring"),
+]
+stage_times = defaultdict(float)
+
+def timed_stage(func, stage):
+    if inspect.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                stage_times[stage] += time.perf_counter() - start
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage_times[stage] += time.perf_counter() - start
+    return wrapper
+
+def instrument():
+    for module, name, stage in STAGES:
+        setattr(module, name, timed_stage(getattr(module, name), stage))
+
+def clear_process_caches():
+    importPrices.stores_cache.clear()
+    importPrices.prices_cache.clear()
+    geocodeStore.geocode_cache.clear()
+    spatialIndex.branch_grid.clear()
+
+async def measure(cart, address):
+    stage_times.clear()
+    requests_before = dict(services.requests)
+    start = time.perf_counter()
+    supermarkets, _ = await bestBranches.get_best_supermarkets(cart, address, 0.5)
+    elapsed = time.perf_counter() - start
+    requests = {k: services.requests[k] - requests_before.get(k, 0) for k in services.requests}
+    return elapsed, dict(stage_times), requests, len(supermarkets)
+
+async def throughput(carts, address, concurrency):
+    #requests per second with concurrency requests in flight
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(cart):
+        async with slots:
+            await bestBranches.get_best_supermarkets(cart, address, 0.5)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(cart) for cart in carts])
+    return len(carts) / (time.perf_counter() - start)
+
+def row(branches, size, mode, elapsed, stages, requests, found):
+    cells = " ".join(f"{stages.get(stage, 0) * 1000:9.1f}" for _, _, stage in STAGES)
+    calls = "/".join(str(requests.get(k, 0)) for k in ("chp", "distance_matrix", "geocode"))
+    print(f"{branches:>8} {size:>4} {mode:>7} {elapsed * 1000:9.1f} {cells} {calls:>14} {found:>5}")
+
+async def run(args):
+    db = MemoryDb(args.db_ms).install()
+    instrument()
+    cpuPool.start()
+    await httpClient.start()
+
+    stage_names = " ".join(f"{stage:>9}" for _, _, stage in STAGES)
+    print(f"latency ms: chp {args.chp_ms}, distance matrix {args.maps_ms}, geocode {args.geocode_ms}, db {args.db_ms}")
+    print(f"parse executor: {cpuPool.pool_stats()['executor']} ({cpuPool.parse_workers()} workers)")
+    print(f"{'branches':>8} {'cart':>4} {'mode':>7} {'total_ms':>9} {stage_names} {'chp/dm/geo':>14} {'found':>5}")
+    summary = []
+    try:
+        for branches in args.branches:
+            world = World(branches, max(args.carts) * 2, seed=branches)
+            services.set_world(world)
+            for size in args.carts:
+                cart = world.cart(size, seed=size)
+
+                db.clear()
+                clear_process_caches()
+                row(branches, size, "cold", *await measure(cart, world.cart_address))
+                clear_process_caches()
+                row(branches, size, "restart", *await measure(cart, world.cart_address))
+                row(branches, size, "warm", *await measure(cart, world.cart_address))
+
+                #different carts of the same size in the same area
+                carts = [world.cart(size, seed=1000 + i) for i in range(args.concurrency * 2)]
+                db.clear()
+                clear_process_caches()
+                cold_rps = await throughput(carts, world.cart_address, args.concurrency)
+                warm_rps = await throughput(carts, world.cart_address, args.concurrency)
+                summary.append((branches, size, cold_rps, warm_rps))
+    finally:
+        await httpClient.close()
+        services.stop()
+        cpuPool.shutdown()
+
+    print()
+    print(f"throughput, {args.concurrency} requests in flight")
+    print(f"{'branches':>8} {'cart':>4} {'cold_rps':>9} {'warm_rps':>9}")
+    for branches, size, cold_rps, warm_rps in summary:
+        print(f"{branches:>8} {size:>4} {cold_rps:9.2f} {warm_rps:9.2f}")
+
+def parse_args():
+    def numbers(text):
+        return [int(n) for n in text.split(",")]
+
+    parser = argparse.ArgumentParser(description="offline end-to-end benchmark of get_best_supermarkets")
+    parser.add_argument("--carts", type=numbers, default=[1, 5, 10, 20, 50], help="cart sizes")
+    parser.add_argument("--branches", type=numbers, default=[10, 100, 1000], help="branches in the area")
+    parser.add_argument("--chp-ms", type=float, default=150)
+    parser.add_argument("--maps-ms", type=float, default=80)
+    parser.add_argument("--geocode-ms", type=float, default=100)
+    parser.add_argument("--db-ms", type=float, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    services.latency_ms.update({"chp": args.chp_ms, "distance_matrix": args.maps_ms, "geocode": args.geocode_ms})
+    services.start()
+    asyncio.run(run(args))
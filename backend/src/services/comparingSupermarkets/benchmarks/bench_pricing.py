@@ -0,0 +1,89 @@
+#micro-benchmark: per-row df.apply(calculate_total_price) vs the vectorized pricing engine
+#usage: python benchmarks/bench_pricing.py [stores] [products]
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from pricing import basket_totals, basket_price
+
+#the per-row pricing bestBranches used before pricing.py, kept as the reference the engine must match
+def calculate_total_price(unit_price, quantity, sale_price, required_quantity):
+    if (pd.isna(sale_price) or pd.isna(required_quantity)):
+        return unit_price * quantity
+    num_of_discount_groups = quantity // required_quantity  # times to use the discount
+    remaining_units = quantity % required_quantity  # times to use regular price
+    
+    total_price = (num_of_discount_groups * sale_price * required_quantity) + (remaining_units * unit_price)
+    return total_price
+
+def synthetic_frame(n_stores, n_products, seed=0):
+    rng = np.random.default_rng(seed)
+    products = [f"product {i}" for i in range(n_products)]
+    cart = {p: int(q) for p, q in zip(products, rng.integers(1, 7, n_products))}
+
+    regular = rng.uniform(3, 60, (n_stores, n_products)).round(2)
+    sale = np.where(rng.random((n_stores, n_products)) < 0.4, (regular * 0.8).round(2), np.nan)
+    required = np.where(rng.random((n_stores, n_products)) < 0.5, rng.integers(1, 4, (n_stores, n_products)), np.nan)
+    #a sale price without a required quantity must fall back to the regular price too
+    required[rng.random((n_stores, n_products)) < 0.05] = np.nan
+
+    records = []
+    for s in range(n_stores):
+        row = {"Store": f"store {s}", "Address": f"address {s}"}
+        for j, p in enumerate(products):
+            row[p] = regular[s, j]
+            row[f"{p} (Regular Price)"] = regular[s, j]
+            row[f"{p} (Sale Price)"] = None if np.isnan(sale[s, j]) else sale[s, j]
+            row[f"{p} (Required Quantity)"] = None if np.isnan(required[s, j]) else int(required[s, j])
+        records.append(row)
+    return pd.DataFrame(records), cart
+
+def apply_prices(df, cart):
+    df = df.copy()
+    for product in cart:
+        df[f"{product} (Total Price)"] = df.apply(
+            lambda row: calculate_total_price(
+                unit_price=row[f"{product} (Regular Price)"],
+                quantity=cart[product],
+                sale_price=row[f"{product} (Sale Price)"],
+                required_quantity=row[f"{product} (Required Quantity)"]
+            ),
+            axis=1
+        )
+    return df[[col for col in df.columns if "(Total Price)" in col]].sum(axis=1, min_count=1).to_numpy()
+
+def vectorized_prices(df, cart):
+    def matrix(suffix):
+        return df[[f"{product} ({suffix})" for product in cart]].to_numpy(dtype=float, na_value=np.nan)
+    totals = basket_totals(matrix("Regular Price"), matrix("Sale Price"), matrix("Required Quantity"), list(cart.values()))
+    return basket_price(totals)
+
+def best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    n_stores = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    n_products = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    df, cart = synthetic_frame(n_stores, n_products)
+
+    apply_time, expected = best_of(lambda: apply_prices(df, cart), 3)
+    vector_time, actual = best_of(lambda: vectorized_prices(df, cart), 20)
+
+    #the engine must price every basket exactly like calculate_total_price
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9, equal_nan=True)
+
+    print(f"{n_stores} stores x {n_products} products")
+    print(f"df.apply:   {apply_time * 1000:9.2f} ms")
+    print(f"vectorized: {vector_time * 1000:9.2f} ms")
+    print(f"speedup:    {apply_time / vector_time:9.1f}x")
+
+if __name__ == "__main__":
+    main()
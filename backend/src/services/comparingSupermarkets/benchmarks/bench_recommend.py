@@ -0,0 +1,85 @@
+#benchmark of recommendedToRemove over synthetic store coverage matrices of increasing size,
+#against the combinations search it replaced (run only while that one stays small enough)
+#usage: python benchmarks/bench_recommend.py
+import os
+import sys
+import time
+from collections import defaultdict
+from itertools import combinations
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+#the db client connects lazily, nothing is read from it here
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+from importPrices import recommendedToRemove
+from storeCoverage import CoverageIndex
+
+#the store filter and search recommendedToRemove used before the coverage masks
+def filterStores(store_data, product_list):
+    filtered_data = defaultdict(dict)
+    stores_missing_products = defaultdict(set)
+
+    store_to_products = defaultdict(dict)
+    for product, stores in store_data.items():
+        for (store, address), data in stores.items():
+            store_to_products[(store, address)][product] = data
+
+    for (store, address), products in store_to_products.items():
+        missing_products = set(product_list) - set(products.keys())
+
+        if missing_products:
+            for product in missing_products:
+                stores_missing_products[product].add((store, address))
+        else:
+            filtered_data[(store, address)] = products
+    return dict(filtered_data), dict(stores_missing_products)
+
+def combinations_search(store_data, stores_missing_products, product_list):
+    problematic_products = list(stores_missing_products.keys())
+    for r in range(1, len(problematic_products)):
+        for combo in combinations(problematic_products, r):
+            remaining_products = [p for p in product_list if p not in combo]
+            temp_filtered_data, _ = filterStores(store_data, remaining_products)
+            if len(temp_filtered_data) >= 5:
+                return list(combo)
+    return []
+
+def synthetic_coverage(n_stores, n_products, seed):
+    #a sparse area: every store misses a few random products of the cart
+    rng = np.random.default_rng(seed)
+    products = [f"product {j}" for j in range(n_products)]
+    sells = np.ones((n_stores, n_products), dtype=bool)
+    for i in range(n_stores):
+        missing = rng.choice(n_products, size=min(1 + rng.poisson(2), n_products), replace=False)
+        sells[i, missing] = False
+    store_data = {
+        p: {(f"store {i}", f"address {i}"): None for i in np.flatnonzero(sells[:, j])}
+        for j, p in enumerate(products)
+    }
+    #a fixed product order, the combinations search depends on it
+    _, missing = filterStores(store_data, products)
+    stores_missing = {p: missing[p] for p in products if p in missing}
+    return store_data, stores_missing, products
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    print(f"{'stores':>7} {'products':>8} {'problematic':>11} {'combinations':>13} {'new':>9}  removal")
+    for n_stores, n_products in [(10, 6), (20, 8), (30, 10), (12, 16), (14, 18), (16, 20), (100, 20), (40, 40), (300, 30), (1000, 50), (1000, 80)]:
+        store_data, stores_missing, products = synthetic_coverage(n_stores, n_products, seed=n_products)
+        store_lists = {p: list(stores) for p, stores in store_data.items()}
+        new_time, new_result = timed(lambda: recommendedToRemove(CoverageIndex(store_lists, products)))
+
+        old_cell = "skipped"
+        if len(stores_missing) <= 20:
+            old_time, old_result = timed(combinations_search, store_data, stores_missing, products)
+            assert new_result == old_result, (n_stores, n_products, old_result, new_result)
+            old_cell = f"{old_time * 1000:.1f} ms"
+
+        print(f"{n_stores:>7} {n_products:>8} {len(stores_missing):>11} {old_cell:>13} {new_time * 1000:7.1f} ms  {len(new_result)} products")
+
+if __name__ == "__main__":
+    main()
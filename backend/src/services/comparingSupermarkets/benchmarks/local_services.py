@@ -0,0 +1,163 @@
+#local stand-ins of chp.co.il, the Distance Matrix API, Nominatim and the Google Maps search page.
+#they answer from a synthetic.World with a configurable latency, on their own thread and event loop
+#so serving them does not take time from the pipeline being measured
+import asyncio
+import html
+import os
+import random
+import socket
+import threading
+from collections import Counter
+from aiohttp import web
+
+from synthetic import road_km
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+#a recorded compare_results page: the generated rows replace the rows of its results table
+RECORDED_PAGE = os.path.join(FIXTURES, "compare_results_milk.html")
+NOT_FOUND_PAGE = os.path.join(FIXTURES, "compare_results_not_found.html")
+
+ROW = """<tr class="line-{index}">
+  <td>{store}</td>
+  <td><span class="chain">{chain}</span></td>
+  <td>
+    {address}
+  </td>
+  <td>{sale}</td>
+  <td>{regular:.2f}</td>
+</tr>
+"""
+DISCOUNT_BUTTON = ('<button type="button" class="btn btn-xs btn-discount" data-toggle="popover" '
+                   'data-discount-desc="{desc}">{sale:.2f}</button>')
+
+def page_template():
+    #(text before the first row, text after the last row) of the recorded page
+    with open(RECORDED_PAGE, encoding="utf-8") as f:
+        page = f.read()
+    table = page.index('<table class="table results-table"')
+    start = page.index("<tbody>", table) + len("<tbody>\n")
+    end = page.index("</tbody>", start)
+    return page[:start], page[end:]
+
+class LocalServices:
+    def __init__(self, world, latency_ms=None, jitter=0.2):
+        #latency_ms: {"chp", "distance_matrix", "geocode"} -> milliseconds per request
+        self.world = world
+        self.latency_ms = {"chp": 150, "distance_matrix": 80, "geocode": 100, **(latency_ms or {})}
+        self.jitter = jitter
+        self.requests = Counter()
+        self._prefix, self._suffix = page_template()
+        with open(NOT_FOUND_PAGE, encoding="utf-8") as f:
+            self._not_found = f.read()
+        self._pages = {}  #product -> rendered page, rendering is not what is measured
+        self._loop = None
+        self._runner = None
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self._socket.getsockname()[1]}"
+
+    def set_world(self, world):
+        self.world = world
+        self._pages = {}
+
+    async def _delay(self, service):
+        latency = self.latency_ms[service] / 1000
+        await asyncio.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _render(self, product):
+        rows = self.world.prices.get(product)
+        if rows is None:
+            return self._not_found
+        parts = [self._prefix]
+        for index, (b, regular, sale, discount) in enumerate(rows):
+            store, address = self.world.branches[b]
+            parts.append(ROW.format(
+                index=index,
+                store=html.escape(store),
+                chain=html.escape(store.split(" סניף")[0]),
+                address=html.escape(address),
+                sale=DISCOUNT_BUTTON.format(desc=html.escape(discount), sale=sale) if sale is not None else "",
+                regular=regular,
+            ))
+        parts.append(self._suffix)
+        return "".join(parts)
+
+    async def compare_results(self, request):
+        self.requests["chp"] += 1
+        product = request.query.get("product_name_or_barcode", "")
+        page = self._pages.get(product)
+        if page is None:
+            page = self._pages[product] = self._render(product)
+        await self._delay("chp")
+        return web.Response(text=page, content_type="text/html")
+
+    async def distance_matrix(self, request):
+        self.requests["distance_matrix"] += 1
+        origin = self.world.locate(request.query.get("origins", ""))
+        elements = []
+        for destination in request.query.get("destinations", "").split("|"):
+            coords = self.world.locate(destination)
+            if origin is None or coords is None:
+                elements.append({"status": "NOT_FOUND"})
+            else:
+                km = road_km(origin, coords)
+                elements.append({"status": "OK", "distance": {"value": int(km * 1000), "text": f"{km:.1f} km"}})
+        await self._delay("distance_matrix")
+        return web.json_response({"status": "OK", "rows": [{"elements": elements}]})
+
+    async def nominatim(self, request):
+        self.requests["geocode"] += 1
+        address = request.query.get("q", "")
+        if address.endswith(", ישראל"):
+            address = address[:-len(", ישראל")]
+        coords = self.world.coords.get(address)
+        await self._delay("geocode")
+        if coords is None:
+            return web.json_response([])
+        return web.json_response([{"lat": str(coords[0]), "lon": str(coords[1])}])
+
+    async def maps_search(self, request):
+        self.requests["geocode"] += 1
+        coords = self.world.coords.get(request.match_info["address"])
+        await self._delay("geocode")
+        #the page embeds [3, lon, lat], see get_coordinates_from_google_maps
+        text = f"window.APP_INITIALIZATION_STATE=[[[3,{coords[1]},{coords[0]}]]]" if coords else "<html></html>"
+        return web.Response(text=text, content_type="text/html")
+
+    def _app(self):
+        app = web.Application()
+        app.router.add_get("/main_page/compare_results", self.compare_results)
+        app.router.add_get("/maps/api/distancematrix/json", self.distance_matrix)
+        app.router.add_get("/search", self.nominatim)
+        app.router.add_get("/maps/search/{address}", self.maps_search)
+        return app
+
+    def environment(self):
+        #the Config variables that point the pipeline here, set before it is imported
+        return {
+            "CHP_URL": self.url,
+            "GOOGLE_MAPS_URL": self.url,
+            "GOOGLE_MAPS_API_URL": self.url,
+            "NOMINATIM_URL": self.url,
+        }
+
+    def start(self):
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self._app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.SockSite(self._runner, self._socket).start())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, name="local-services", daemon=True).start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
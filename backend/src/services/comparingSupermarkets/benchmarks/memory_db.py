@@ -0,0 +1,95 @@
+#in-memory stand-in of the collections dbAccess reads and writes, with a configurable round trip.
+#install() swaps the dbAccess functions, the pipeline code is not changed
+import asyncio
+
+import dbAccess
+
+class MemoryDb:
+    def __init__(self, latency_ms=2):
+        self.latency_ms = latency_ms
+        self.round_trips = 0
+        self.clear()
+
+    def clear(self):
+        self.find_stores = {}  #(cart_address, product_name) -> document
+        self.find_prices = {}  #(product_name, store_name, store_address) -> document
+        self.not_found = {}  #cart_address -> [document]
+        self.distances = {}  #(from, to) -> document
+        self.geocodes = {}  #address -> document
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+
+    @staticmethod
+    def _upsert(collection, key, operation):
+        #UpdateOne({...}, {"$set": {...}}, upsert=True), the only write the pipeline makes
+        document = collection.setdefault(key, dict(operation._filter))
+        document.update(operation._doc["$set"])
+
+    async def find_store_lists(self, cart_address, products):
+        await self._round_trip()
+        return [dict(self.find_stores[(cart_address, p)]) for p in products if (cart_address, p) in self.find_stores]
+
+    async def write_store_lists(self, operations):
+        if operations:
+            await self._round_trip()
+            for op in operations:
+                self._upsert(self.find_stores, (op._filter["cart_address"], op._filter["product_name"]), op)
+
+    async def find_product_prices(self, products):
+        await self._round_trip()
+        products = set(products)
+        return [dict(doc) for key, doc in self.find_prices.items() if key[0] in products]
+
+    async def write_prices(self, operations):
+        if operations:
+            await self._round_trip()
+            for op in operations:
+                f = op._filter
+                self._upsert(self.find_prices, (f["product_name"], f["store_name"], f["store_address"]), op)
+
+    async def find_not_found(self, cart_address):
+        await self._round_trip()
+        return list(self.not_found.get(cart_address, []))
+
+    async def find_distances(self, from_address, to_addresses):
+        await self._round_trip()
+        return [
+            {"to": to, "distance": self.distances[(from_address, to)]["distance"]}
+            for to in to_addresses if (from_address, to) in self.distances
+        ]
+
+    async def insert_distances(self, docs):
+        if docs:
+            await self._round_trip()
+            for doc in docs:
+                #the unique (from, to) index keeps the first document
+                self.distances.setdefault((doc["from"], doc["to"]), dict(doc))
+
+    async def find_geocodes(self, addresses, now):
+        await self._round_trip()
+        return [
+            {k: v for k, v in self.geocodes[a].items() if k != "_id"}
+            for a in addresses if a in self.geocodes and self.geocodes[a]["expires_at"] > now
+        ]
+
+    async def write_geocodes(self, operations):
+        if operations:
+            await self._round_trip()
+            for op in operations:
+                self._upsert(self.geocodes, op._filter["address"], op)
+
+    def install(self):
+        for name in ("find_store_lists", "write_store_lists", "find_product_prices", "write_prices",
+                     "find_not_found", "find_distances", "insert_distances", "find_geocodes", "write_geocodes"):
+            setattr(dbAccess, name, getattr(self, name))
+        return self
+
+    def counts(self):
+        return {
+            "findStores": len(self.find_stores),
+            "findPrices": len(self.find_prices),
+            "distances": len(self.distances),
+            "geocodes": len(self.geocodes),
+        }
@@ -0,0 +1,78 @@
+#synthetic areas for the offline benchmarks: branches with coordinates, a product catalog
+#with per-branch prices, and carts. everything is derived from the seed
+import math
+import numpy as np
+
+CHAINS = ["שופרסל", "רמי לוי", "טיב טעם", "מחסני השוק", "אושר עד", "יוחננוף", "ויקטורי", "יינות ביתן"]
+STREETS = ["הרצל", "ויצמן", "ז'בוטינסקי", "קלאוזנר", "דיזנגוף", "יששכר", "החרמון", "בן גוריון", "הנופר", "סוקולוב"]
+CITIES = ["נתניה", "רמת גן", "פתח תקווה", "הרצליה", "כפר סבא", "רעננה", "חולון", "בת ים"]
+CART_ADDRESS = "יששכר 1, נתניה"
+CART_COORDS = (32.3215, 34.8532)
+#driving distance / straight-line distance in the Distance Matrix stand-in
+ROAD_FACTOR = 1.3
+
+class World:
+    #one area: the branches around CART_ADDRESS and what each of them sells
+    def __init__(self, n_branches, n_products, seed=0, radius_km=20, online_share=0.02):
+        rng = np.random.default_rng(seed)
+        self.cart_address = CART_ADDRESS
+        self.products = [f"מוצר בדיקה {j}, {int(rng.integers(1, 10)) * 100} גרם" for j in range(n_products)]
+
+        self.branches = []  #[(store name, address)]
+        self.coords = {CART_ADDRESS: CART_COORDS}  #address -> (lat, lon)
+        for i in range(n_branches):
+            chain = CHAINS[i % len(CHAINS)]
+            store_name = f"{chain} סניף {i}"
+            if rng.random() < online_share:
+                #online shops are listed with a website instead of an address
+                self.branches.append((store_name, f"https://shop{i}.example.co.il"))
+                continue
+            address = f"{STREETS[i % len(STREETS)]} {i + 1}, {CITIES[(i // len(STREETS)) % len(CITIES)]}"
+            #uniform in a disc around the cart
+            distance = radius_km * math.sqrt(rng.random())
+            angle = rng.random() * 2 * math.pi
+            lat = CART_COORDS[0] + distance * math.cos(angle) / 111.32
+            lon = CART_COORDS[1] + distance * math.sin(angle) / (111.32 * math.cos(math.radians(CART_COORDS[0])))
+            self.branches.append((store_name, address))
+            self.coords[address] = (round(lat, 6), round(lon, 6))
+
+        #prices[product] -> [(branch index, regular, sale or None, discount text or None)]
+        self.prices = {}
+        for product in self.products:
+            base = rng.uniform(3, 60)
+            rows = []
+            for b in range(n_branches):
+                if rng.random() < 0.1:
+                    continue  #not sold there
+                regular = round(base * rng.uniform(0.85, 1.2), 2)
+                sale, discount = None, None
+                if rng.random() < 0.3:
+                    required = int(rng.integers(1, 4))
+                    sale = round(regular * 0.8, 2)
+                    discount = f"{required} יחידות ב {sale * required:.2f} ש״ח" if required > 1 else f"מחיר מבצע {sale:.2f} ש״ח"
+                rows.append((b, regular, sale, discount))
+            self.prices[product] = rows
+
+    def cart(self, size, seed=0):
+        #{product: quantity} of size products of the catalog
+        rng = np.random.default_rng(seed)
+        chosen = rng.choice(len(self.products), size=min(size, len(self.products)), replace=False)
+        return {self.products[j]: int(rng.integers(1, 6)) for j in sorted(chosen)}
+
+    def locate(self, text):
+        #coordinates of an address or of a "lat,lon" string, None if unknown
+        if text in self.coords:
+            return self.coords[text]
+        parts = text.split(",")
+        if len(parts) == 2:
+            try:
+                return float(parts[0]), float(parts[1])
+            except ValueError:
+                pass
+        return None
+
+def road_km(a, b):
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return ROAD_FACTOR * 2 * 6371.0088 * math.asin(math.sqrt(min(h, 1)))
@@ -1,140 +1,320 @@
-import pandas as pd
-import math
-from importPrices import get_store_data
+import numpy as np
+from importPrices import get_store_data, prefetch_area, pricesFromDB, SharedLookups
+from pricing import basket_price
 
-from distance_calculator import calculate_distances
-from src.db.index import get_db
+from distance_calculator import calculate_distances, prune_far_addresses
+import dbAccess
+import httpClient
+import metrics
+import cpuPool
+from addressKey import address_key
+from cache import TTLCache
 from pymongo.errors import BulkWriteError
 
 import asyncio
+import secrets
+import sys
+import os
+from collections import defaultdict
 
-"""
-import time
-from functools import wraps
-
-def measure_time(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"{func.__name__} took {elapsed_time:.4f} seconds")
-        return result
-    return wrapper
-
-    @measure_time
-"""
-db = get_db()
-distance_collection = db["distances"]
-
-async def get_distances(cart_address, address_list):
-    existing_docs = distance_collection.aggregate([
-        {"$match": {"from": cart_address, "to": {"$in": address_list}}},
-        {"$project": {"to": 1, "distance": 1, "_id": 0}}
-    ])
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+
+MAX_DISTANCE = 10  #km, farther stores are not suggested
+
+async def find_cached_distances(cart_address, address_list):
+    #{address: distance} of the addresses already in the distances collection,
+    #which is keyed by address_key while the result uses the addresses as given
+    cart_key = address_key(cart_address)
+    keys = {addr: address_key(addr) for addr in address_list}
+    existing_docs = await dbAccess.find_distances(cart_key, list(set(keys.values())))
     existing_map = {doc["to"]: doc["distance"] for doc in existing_docs}
+    return {addr: existing_map[keys[addr]] for addr in address_list if keys[addr] in existing_map}
 
-    missing_addresses = [addr for addr in address_list if addr not in existing_map]
+@metrics.timed("distances")
+async def get_distances(cart_address, address_list, cached=None):
+    #cached: find_cached_distances of the same addresses, when the caller already has it
+    if cached is None:
+        cached = await find_cached_distances(cart_address, address_list)
+    cart_key = address_key(cart_address)
+
+    missing_addresses = [addr for addr in address_list if addr not in cached]
 
     result_distances = [
-        {"from": cart_address, "to": addr, "distance": existing_map[addr]}
-        for addr in existing_map
+        {"from": cart_address, "to": addr, "distance": distance}
+        for addr, distance in cached.items()
     ]
 
+    #branches that are surely too far need no driving distance
+    missing_addresses = await prune_far_addresses(cart_address, missing_addresses, MAX_DISTANCE)
+
     if missing_addresses:
         new_distances_raw = await calculate_distances(cart_address, missing_addresses)
-        new_docs = []
+        new_docs = {}
         for d in new_distances_raw:
             if d["Distance (km)"] is not None:
-                doc = {
+                result_distances.append({
                     "from": cart_address,
                     "to": d["Address"],
                     "distance": d["Distance (km)"]
-                }
-                result_distances.append(doc)
-                new_docs.append(doc)
+                })
+                to_key = address_key(d["Address"])
+                new_docs[to_key] = {"from": cart_key, "to": to_key, "distance": d["Distance (km)"]}
                 
         if new_docs:
             try:
-                distance_collection.insert_many(new_docs, ordered=False)
+                await dbAccess.insert_distances(list(new_docs.values()))
             except BulkWriteError:
                 pass
     return result_distances
 
 
-def calculate_total_price(unit_price, quantity, sale_price, required_quantity):
-    if (pd.isna(sale_price) or pd.isna(required_quantity)):
-        return unit_price * quantity
-    num_of_discount_groups = quantity // required_quantity  # times to use the discount
-    remaining_units = quantity % required_quantity  # times to use regular price
-    
-    total_price = (num_of_discount_groups * sale_price * required_quantity) + (remaining_units * unit_price)
-    return total_price
-
-async def get_best_supermarkets(cart, address, alpha):
-    df, recommended_removals = await get_store_data(address, cart) #send the products
-    if df.empty:
-        return [], recommended_removals
-    # price columns (second and above)
-    price_columns = df.columns[2:]  
-    for product in cart:
-        if product in price_columns:
-            df[f"{product} (Total Price)"] = df.apply(
-                lambda row: calculate_total_price(
-                    unit_price=row[f"{product} (Regular Price)"],
-                    quantity=cart[product],
-                    sale_price=row[f"{product} (Sale Price)"],
-                    required_quantity=row[f"{product} (Required Quantity)"]
-                ),
-                axis=1
-            )
-    df['price'] = df[[col for col in df.columns if "(Total Price)" in col]].sum(axis=1, min_count=1)
-    store_addresses = df['Address'].tolist()
-    
-    distance_results = await get_distances(address, store_addresses)
-    if not distance_results:
-        return [], recommended_removals
-    
-    distance_map = {entry["to"]: entry["distance"] for entry in distance_results}
-
-    df['distance'] = df['Address'].map(distance_map)
+def optional(value):
+    #NaN -> None, so the result is valid JSON
+    return None if np.isnan(value) else float(value)
 
-    df = df[df['distance'] <= 10]
+def score_components(price_matrix, distance_map):
+    #the scores of the stores up to MAX_DISTANCE before alpha weighs them, stores without a distance
+    #are left out: (nearby rows, basket price, distance, price score, distance score), None if none
+    price = basket_price(price_matrix.totals())
+    store_addresses = price_matrix.addresses
+    distance = np.array([distance_map.get(addr, np.nan) for addr in store_addresses], dtype=float)
 
-    if df.empty:
-        return [], recommended_removals
+    #only the stores up to 10 km, NaN distances are dropped too
+    nearby = np.flatnonzero(distance <= MAX_DISTANCE)
+    if nearby.size == 0:
+        return None
+    price, distance = price[nearby], distance[nearby]
 
     # scores
-    max_price, min_price = df['price'].max(), df['price'].min()
+    max_price, min_price = np.nanmax(price), np.nanmin(price)
     if max_price == min_price:
-        df['price_score'] = 10
+        price_score = np.full(price.shape, 10.0)
     else:
-        df['price_score'] = 10 - 9 * (df['price'] - min_price) / (max_price - min_price)
+        price_score = 10 - 9 * (price - min_price) / (max_price - min_price)
 
     too_far = 5  #maximum relevant distance in km
-    df['distance_score'] = 10 - 9 * (df['distance'] / too_far)
-    df['distance_score'] = df['distance_score'].clip(lower=1, upper=10) #scale score between 1 and 10
+    distance_score = np.clip(10 - 9 * (distance / too_far), 1, 10) #scale score between 1 and 10
+    return nearby, price, distance, price_score, distance_score
+
+def final_scores(price_score, distance_score, alpha):
+    final_score = alpha * price_score + (1 - alpha) * distance_score
+    return np.ceil(np.minimum(final_score / 2, 5)) #final_score to 1-5: dividing by 2 and rounding up, 5 max
+
+def top_five(final_score, positions, total):
+    #top 5 by final score (descending order), ties in store order: the scores are whole numbers,
+    #so score and position (of total nearby stores) make one key, partitioned and then only the 5 are sorted
+    order = -final_score * total + positions
+    if len(order) > 5:
+        top_5 = np.argpartition(order, 4)[:5]
+        return top_5[np.argsort(order[top_5])]
+    return np.argsort(order)
+
+def store_record(price_matrix, unit_prices, i, price, distance, final_score):
+    store_name, store_address = price_matrix.stores[i]
+    return {
+        "Store": store_name,
+        "Address": store_address,
+        "price": optional(price),
+        "distance": float(distance),
+        "final_score": None if final_score is None else int(final_score),
+        #add the price per product
+        "product_prices": {
+            product: optional(unit_prices[i, j])
+            for j, product in enumerate(price_matrix.products)
+        },
+    }
+
+@metrics.timed("scoring")
+def rank_supermarkets(price_matrix, distance_map, alpha):
+    #top 5 records of the stores up to MAX_DISTANCE
+    components = score_components(price_matrix, distance_map)
+    if components is None:
+        return []
+    nearby, price, distance, price_score, distance_score = components
+    final_score = final_scores(price_score, distance_score, alpha)
+    top_5 = top_five(final_score, np.arange(len(final_score)), len(final_score))
+
+    #only the top 5 stores are turned into records
+    unit_prices = price_matrix.unit_prices()
+    return [
+        store_record(price_matrix, unit_prices, nearby[k], price[k], distance[k], final_score[k])
+        for k in top_5
+    ]
+
+def contenders(price, distance, places=5):
+    #the stores that make the top places for some alpha in [0, 1]. a store at most as expensive and
+    #as far as another one listed after it scores at least as high for every alpha and wins the tie,
+    #so a store with places such stores before it never makes the top places
+    price = np.where(np.isnan(price), np.inf, price)
+    n = len(price)
+    beaten_by = np.zeros(n, dtype=int)
+    for start in range(0, n, 1024):
+        rows = np.arange(start, min(start + 1024, n))
+        before = np.arange(n)[None, :] < rows[:, None]
+        beaten_by[rows] = (
+            before & (price[None, :] <= price[rows, None]) & (distance[None, :] <= distance[rows, None])
+        ).sum(axis=1)
+    return beaten_by < places
+
+def pareto_frontier(price, distance):
+    #rows of the stores no other store beats on both price and distance, cheapest first
+    order = np.lexsort((distance, price))
+    frontier = []
+    closest = np.inf
+    for k in order:
+        if not np.isnan(price[k]) and distance[k] < closest:
+            frontier.append(k)
+            closest = distance[k]
+    return frontier
+
+class RankingSession:
+    #what rank_supermarkets needs of one comparison that alpha does not change, so a new alpha
+    #is ranked without running the pipeline again. only the contenders are kept
+    def __init__(self, price_matrix, distance_map, recommendations, fingerprint):
+        self.recommendations = recommendations
+        self.fingerprint = fingerprint
+        components = score_components(price_matrix, distance_map) if len(price_matrix) else None
+        if components is None:
+            self.total = 0
+            self.positions = np.zeros(0, dtype=int)
+            self.price_score = self.distance_score = np.zeros(0)
+            self.records = []
+            self.frontier = []
+            return
+
+        nearby, price, distance, price_score, distance_score = components
+        self.total = len(price)
+        self.positions = np.flatnonzero(contenders(price, distance))
+        self.price_score = price_score[self.positions]
+        self.distance_score = distance_score[self.positions]
+        unit_prices = price_matrix.unit_prices()
+        self.records = [
+            store_record(price_matrix, unit_prices, nearby[k], price[k], distance[k], None)
+            for k in self.positions
+        ]
+        self.frontier = [
+            {
+                "Store": price_matrix.stores[nearby[k]][0],
+                "Address": price_matrix.stores[nearby[k]][1],
+                "price": optional(price[k]),
+                "distance": float(distance[k]),
+            }
+            for k in pareto_frontier(price, distance)
+        ]
+
+    def rank(self, alpha):
+        #the records rank_supermarkets returns for alpha
+        final_score = final_scores(self.price_score, self.distance_score, alpha)
+        return [
+            {**self.records[k], "final_score": int(final_score[k])}
+            for k in top_five(final_score, self.positions, self.total)
+        ]
+
+def cart_fingerprint(cart, address):
+    #a session is only rescored for the cart and address it was computed for
+    return address_key(address), tuple(sorted((p, q) for p, q in cart.items()))
+
+#session token -> RankingSession
+ranking_sessions = TTLCache(Config.RANKING_SESSIONS_SIZE, Config.RANKING_SESSION_TTL)
+
+def session_stats():
+    return ranking_sessions.stats()
+
+async def measure_distances(cart_address, stores, lookups):
+    #the distances of the branches lookups has not looked up yet, into lookups.distances
+    new_addresses = [addr for addr in dict.fromkeys(addr for _, addr in stores) if addr not in lookups.measured]
+    if not new_addresses:
+        return
+    cached = await find_cached_distances(cart_address, new_addresses)
+    distance_results = await get_distances(cart_address, new_addresses, cached)
+    lookups.distances.update((entry["to"], entry["distance"]) for entry in distance_results)
+    lookups.measured.update(new_addresses)
+
+async def compare_cart(cart, address, alpha, on_progress=None, shared=None):
+    #the priced stores of the cart and their distances: (price_matrix, distance_map, recommendations).
+    #on_progress(stage, supermarkets) gets the early rankings while the missing prices are fetched:
+    #"provisional" (the prices in the database), then "refined" as fetched pages complete stores.
+    #shared: the SharedLookups of a batch, its distances are already measured
+    lookups = shared if shared is not None else SharedLookups()
+    distance_map = lookups.distances
+
+    #distance first: the branches that sell the whole cart are measured before any price is read,
+    #only the ones up to MAX_DISTANCE are priced
+    async def nearby_stores(stores):
+        await measure_distances(address, stores, lookups)
+        return [(sn, addr) for sn, addr in stores if distance_map.get(addr, np.inf) <= MAX_DISTANCE]
+
+    on_partial = None
+    if on_progress is not None:
+        async def on_partial(partial_matrix, stage):
+            supermarkets = await cpuPool.score(rank_supermarkets, partial_matrix, distance_map, alpha)
+            if supermarkets:
+                await on_progress(stage, supermarkets)
+
+    price_matrix, recommended_removals = await get_store_data(address, cart, on_partial, nearby_stores, shared)
+    return price_matrix, distance_map, recommended_removals
+
+async def get_best_supermarkets(cart, address, alpha, on_progress=None, shared=None):
+    price_matrix, distance_map, recommended_removals = await compare_cart(cart, address, alpha, on_progress, shared)
+    if len(price_matrix) == 0:
+        return [], recommended_removals
+
+    supermarkets = await cpuPool.score(rank_supermarkets, price_matrix, distance_map, alpha)
+    return supermarkets, recommended_removals
+
+async def get_best_supermarkets_session(cart, address, alpha, on_progress=None):
+    #get_best_supermarkets that also keeps a RankingSession for other alphas:
+    #(supermarkets, recommendations, session token, Pareto frontier)
+    price_matrix, distance_map, recommended_removals = await compare_cart(cart, address, alpha, on_progress)
+    session = await cpuPool.score(
+        RankingSession, price_matrix, distance_map, recommended_removals, cart_fingerprint(cart, address))
+    token = secrets.token_urlsafe(16)
+    ranking_sessions.set(token, session)
+    return session.rank(alpha), recommended_removals, token, session.frontier
 
-    # final score
-    df['final_score'] = (alpha * df['price_score'] + (1 - alpha) * df['distance_score'])
-    df['final_score'] = (df['final_score'] / 2).clip(upper=5).apply(math.ceil) #final_score to 1-5: dividing by 2 and rounding up, 5 max
-    
-    price_cols = [f"{product}" for product in cart]
+def rescore_session(token, alpha, cart=None, address=None):
+    #(supermarkets, recommendations, Pareto frontier) of the session for alpha, None when it
+    #expired or was computed for another cart
+    session = ranking_sessions.get(token)
+    if session is None:
+        return None
+    if cart is not None and address is not None and session.fingerprint != cart_fingerprint(cart, address):
+        return None
+    return session.rank(alpha), session.recommendations, session.frontier
 
-    # make sure the column dtype can hold None
-    df[price_cols] = df[price_cols].astype(object)
+async def get_best_supermarkets_batch(items):
+    #items: [{"cart", "address", "alpha"}] -> in the same order, (supermarkets, recommendations)
+    #or the exception of the item. the items of the same area share their lookups: one read of the
+    #store lists and prices, one CHP fetch per product and one distance lookup per branch for all of them
+    areas = defaultdict(list)
+    for i, item in enumerate(items):
+        areas[address_key(item["address"])].append(i)
+    results = [None] * len(items)
 
-    #insert None if null
-    df[price_cols] = df[price_cols].where(df[price_cols].notna(), other=None)
-    
-    #add the price per product
-    df['product_prices'] = df[price_cols].to_dict(orient="records")
+    async def compare_area(indexes):
+        address = items[indexes[0]]["address"]
+        carts = [items[i]["cart"] for i in indexes]
+        try:
+            shared, candidates = await prefetch_area(address, carts)
+            await measure_distances(address, candidates, shared)
+            #one price read of the nearby branches for every cart, the carts then find them in memory
+            nearby = [store for store in candidates if shared.distances.get(store[1], np.inf) <= MAX_DISTANCE]
+            if nearby:
+                await pricesFromDB(list(dict.fromkeys(p for cart in carts for p in cart)), nearby)
+        except Exception as e:
+            for i in indexes:
+                results[i] = e
+            return
+        outcomes = await asyncio.gather(*(
+            get_best_supermarkets(items[i]["cart"], items[i]["address"], items[i].get("alpha", 0.5), shared=shared)
+            for i in indexes
+        ), return_exceptions=True)
+        for i, outcome in zip(indexes, outcomes):
+            results[i] = outcome
 
-    #sort by final score (descending order) and return top 5
-    columns_to_keep = ['Store', 'Address', 'price', 'distance', 'final_score', 'product_prices']
-    top_5_supermarkets = df.sort_values(by='final_score', ascending=False).head(5)[columns_to_keep]
-    return top_5_supermarkets.to_dict(orient="records"), recommended_removals
+    await asyncio.gather(*(compare_area(indexes) for indexes in areas.values()))
+    return results
 
 
 async def main():
@@ -166,6 +346,8 @@ async def main():
 
     except Exception as e:
         print("error", e)
+    finally:
+        await httpClient.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
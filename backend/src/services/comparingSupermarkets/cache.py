@@ -0,0 +1,92 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+class TTLCache:
+    #size-bounded in-memory cache: least recently used entries are evicted first,
+    #and every entry expires after ttl seconds (or at the expiry it was given)
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  #key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            #already expired, e.g. a document the database did not remove yet
+            self._entries.pop(key, None)
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set_from_document(self, key, value, last_updated):
+        #a document expires ttl seconds after its last update, not after it was read
+        self.set(key, value, self.ttl - document_age(last_updated))
+
+    def peek(self, key):
+        #(seconds until expiry, value) without counting a lookup or refreshing the LRU order,
+        #the seconds are negative for an entry that already expired but was not dropped yet
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        return expires_at - time.monotonic(), value
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+def document_age(last_updated):
+    #seconds since a document was written, last_updated is naive UTC as pymongo returns it
+    if last_updated is None:
+        return 0
+    if last_updated.tzinfo is not None:
+        last_updated = last_updated.astimezone(timezone.utc).replace(tzinfo=None)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return max((now - last_updated).total_seconds(), 0)
@@ -0,0 +1,129 @@
+import re
+from html.parser import HTMLParser
+from datetime import datetime, timezone
+
+#the results table of chp.co.il compare_results, found without parsing the rest of the page
+RESULTS_TABLE_START = re.compile(r"<table\b[^>]*results-table", re.IGNORECASE)
+RESULTS_TABLE_CLASS = "table results-table"
+#markup inside these is not part of the page tree, e.g. a table inside a script string
+OPAQUE_BLOCKS = re.compile(r"<!--.*?-->|<(script|style)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+
+def parse_discount_text(discount_text):
+    required_quantity = 1
+    match = re.search(r"(?:(\d+) יחידות ב|קנה אחד, קבל את השני ב)|(\d+\.\d+) ש״ח", discount_text)
+
+    if match:
+        if match.group(1):  # match to quantity
+            required_quantity = int(match.group(1))
+        elif "קנה אחד, קבל את השני ב" in discount_text:
+            required_quantity = 2
+
+    return required_quantity
+
+class _TableEnd(Exception):
+    pass
+
+class ResultsTableParser(HTMLParser):
+    #streaming tokenizer for one <table>: collects the text of every <td> per <tr>
+    #and the discount description of the first btn-discount button in the row.
+    #nesting follows the BeautifulSoup tree: a row also owns the cells and buttons
+    #of rows nested inside it, and an end tag closes everything opened after its start tag
+    def __init__(self):
+        super().__init__()
+        self.matched = None  #whether the first table is the results table
+        self.rows = []  #[[cells, discount_desc]] in document order
+        self._open = []  #stack of (tag, row or cell)
+        self._skip_depth = 0  #inside <script>/<style>, not part of the cell text
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            if self.matched is None:
+                classes = dict(attrs).get("class") or ""
+                self.matched = " ".join(classes.split()) == RESULTS_TABLE_CLASS
+                if not self.matched:
+                    raise _TableEnd()
+            self._open.append(("table", None))
+        elif tag == "tr":
+            row = [[], None]
+            self.rows.append(row)
+            self._open.append(("tr", row))
+        elif tag == "td":
+            cell = []
+            for open_tag, row in self._open:
+                if open_tag == "tr":
+                    row[0].append(cell)
+            self._open.append(("td", cell))
+        elif tag == "button":
+            attrs = dict(attrs)
+            if "btn-discount" in (attrs.get("class") or "").split():
+                for open_tag, row in self._open:
+                    if open_tag == "tr" and row[1] is None:
+                        row[1] = attrs["data-discount-desc"] or ""
+        elif tag in ("script", "style"):
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in ("table", "tr", "td"):
+            for i in range(len(self._open) - 1, -1, -1):
+                if self._open[i][0] == tag:
+                    del self._open[i:]
+                    break
+            if not self._open:
+                raise _TableEnd()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        #a nested cell's text is also part of every cell around it
+        for open_tag, cell in self._open:
+            if open_tag == "td":
+                cell.append(data)
+
+def _results_table_rows(html):
+    opaque = None
+    for match in RESULTS_TABLE_START.finditer(html):
+        if opaque is None:
+            opaque = [block.span() for block in OPAQUE_BLOCKS.finditer(html)]
+        if any(start < match.start() < end for start, end in opaque):
+            continue
+
+        parser = ResultsTableParser()
+        try:
+            parser.feed(html[match.start():])
+            parser.close()
+        except _TableEnd:
+            pass
+        if parser.matched:
+            return [
+                ([("".join(cell)).strip() for cell in cells], discount_desc)
+                for cells, discount_desc in parser.rows
+            ]
+    return None
+
+def parse_results_table(html, now=None):
+    #{(store, address): {Regular Price, Sale Price, Required Quantity, Last Updated}}
+    #None when the page has no results table
+    rows = _results_table_rows(html)
+    if rows is None:
+        return None
+
+    now = now or datetime.now(timezone.utc)
+    stores = {}
+    for cols, discount_desc in rows[1:]:  # skip titles
+        if len(cols) >= 4:
+            store_name, address = cols[0], cols[2]
+            regular_price = cols[-1]
+            sale_price = re.sub(r"[^\d.]", "", cols[-2])  # only numbers and "."
+            required_quantity = None
+            if discount_desc is not None:
+                required_quantity = parse_discount_text(discount_desc)
+
+            stores[(store_name, address)] = {
+                "Regular Price": float(regular_price) if regular_price else None,
+                "Sale Price": float(sale_price) if sale_price else None,
+                "Required Quantity": required_quantity,
+                "Last Updated": now,
+            }
+    return stores
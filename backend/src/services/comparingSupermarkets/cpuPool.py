@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+
+#the CPU work of a comparison, off the event loop so the network reads of the other requests go on:
+#the CHP pages are parsed on PARSE_EXECUTOR ("process": in parallel on every core, HTMLParser
+#holds the GIL; "thread": only frees the loop; "inline": on the loop), large price matrices are
+#scored on a thread, NumPy releases the GIL for the array work
+_parse_pool = None
+_rebuild = None  #future of the pool replacing a broken one, while it starts
+SCORE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="scoring")
+pool_counters = {"offloaded": 0, "inline": 0, "broken": 0}
+
+def parse_workers():
+    return Config.PARSE_WORKERS or os.cpu_count() or 1
+
+def _noop():
+    return None
+
+def _context():
+    #the parse processes come from a fork server (spawn where there is none), never forked from
+    #this process: by then it runs threads (pymongo, the stdin reader, the default executor)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _new_pool():
+    if Config.PARSE_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=parse_workers(), thread_name_prefix="parse")
+    pool = ProcessPoolExecutor(max_workers=parse_workers(), mp_context=_context())
+    #every process is started and has imported the parser before the first page
+    for future in [pool.submit(_noop) for _ in range(parse_workers())]:
+        future.result()
+    return pool
+
+def start():
+    #blocks until the processes are up, called before the first request is read
+    global _parse_pool
+    if _parse_pool is not None or Config.PARSE_EXECUTOR not in ("process", "thread"):
+        return
+    _parse_pool = _new_pool()
+
+def shutdown():
+    global _parse_pool, _rebuild
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+    _rebuild = None
+
+def _replace(broken):
+    #one new pool per broken one, started on a thread so the loop keeps serving; the pages parsed
+    #meanwhile are parsed inline. the callers that hit the same broken pool after the first find
+    #it already gone and do nothing
+    global _parse_pool, _rebuild
+    if _parse_pool is not broken:
+        return
+    broken.shutdown(wait=False)
+    _parse_pool = None
+    rebuild = _rebuild = asyncio.get_running_loop().run_in_executor(None, _new_pool)
+
+    def replaced(future):
+        global _parse_pool, _rebuild
+        if _rebuild is not rebuild:
+            #shut down while it was starting
+            if not future.cancelled() and future.exception() is None:
+                future.result().shutdown(wait=False)
+            return
+        _rebuild = None
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            print(f"parse pool did not start: {future.exception()}", file=sys.stderr, flush=True)
+            return
+        _parse_pool = future.result()
+
+    rebuild.add_done_callback(replaced)
+
+async def parse(func, text):
+    #func(text) on the parse pool; small pages (e.g. "not found") cost more to send than to parse
+    pool = _parse_pool
+    if pool is None or len(text) < Config.PARSE_OFFLOAD_MIN_BYTES:
+        pool_counters["inline"] += 1
+        return func(text)
+    pool_counters["offloaded"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, text)
+    except BrokenProcessPool:
+        #a parse process died: a new pool for the next pages, this one is parsed here
+        pool_counters["broken"] += 1
+        _replace(pool)
+        return func(text)
+
+async def score(func, price_matrix, *args):
+    #func(price_matrix, *args) on a thread when the matrix is large, with the context of the
+    #request so its spans are still counted to it
+    cells = len(price_matrix.stores) * len(price_matrix.products)
+    if cells < Config.SCORE_OFFLOAD_CELLS:
+        return func(price_matrix, *args)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        SCORE_EXECUTOR, partial(context.run, func, price_matrix, *args))
+
+def pool_stats():
+    return {"executor": Config.PARSE_EXECUTOR, "workers": parse_workers(), **pool_counters}
@@ -0,0 +1,90 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+from src.db.index import get_db
+import metrics
+
+#pymongo is blocking, so every call runs on a small thread pool
+#and the event loop keeps serving the CHP and Google fetches meanwhile
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=Config.DB_POOL_SIZE, thread_name_prefix="mongo")
+
+#the client is made on the first query: MongoClient starts monitor threads, and a module that
+#only imports this one (the parse processes, the workers before they serve) must not have them
+_db = None
+_db_lock = threading.Lock()
+
+def collection(name):
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = get_db()
+    return _db[name]
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, partial(func, *args, **kwargs))
+
+#findStores
+@metrics.timed("db.find_store_lists")
+async def find_store_lists(cart_address, products):
+    return await run_db(lambda: list(collection("findStores").find({
+        "cart_address": cart_address,
+        "product_name": {"$in": products}
+    })))
+
+@metrics.timed("db.write_store_lists")
+async def write_store_lists(operations):
+    if operations:
+        await run_db(lambda: collection("findStores").bulk_write(operations, ordered=False))
+
+#findPrices
+@metrics.timed("db.find_product_prices")
+async def find_product_prices(products):
+    return await run_db(lambda: list(collection("findPrices").find({
+        "product_name": {"$in": products}
+    })))
+
+@metrics.timed("db.write_prices")
+async def write_prices(operations):
+    if operations:
+        await run_db(lambda: collection("findPrices").bulk_write(operations, ordered=False))
+
+#notFoundStores
+@metrics.timed("db.find_not_found")
+async def find_not_found(cart_address):
+    return await run_db(lambda: list(collection("notFoundStores").find({
+        "cart_address": cart_address
+    })))
+
+#distances
+@metrics.timed("db.find_distances")
+async def find_distances(from_address, to_addresses):
+    return await run_db(lambda: list(collection("distances").aggregate([
+        {"$match": {"from": from_address, "to": {"$in": to_addresses}}},
+        {"$project": {"to": 1, "distance": 1, "_id": 0}}
+    ])))
+
+@metrics.timed("db.insert_distances")
+async def insert_distances(docs):
+    if docs:
+        await run_db(lambda: collection("distances").insert_many(docs, ordered=False))
+
+#geocodes
+@metrics.timed("db.find_geocodes")
+async def find_geocodes(addresses, now):
+    return await run_db(lambda: list(collection("geocodes").find(
+        {"address": {"$in": addresses}, "expires_at": {"$gt": now}},
+        {"_id": 0}
+    )))
+
+@metrics.timed("db.write_geocodes")
+async def write_geocodes(operations):
+    if operations:
+        await run_db(lambda: collection("geocodes").bulk_write(operations, ordered=False))
@@ -5,54 +5,76 @@ import os
 import re
 import sys
 import asyncio
-import aiohttp
 sys.dont_write_bytecode = True
 from dotenv import load_dotenv
 from urllib.parse import quote
+import httpClient
+import geocodeStore
+import metrics
+import upstream
+from spatialIndex import branch_grid, pruning_counters
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
 
 #load the .env: the GOOGLE_MAPS_API_KEY
 load_dotenv()
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
+GOOGLE_MAPS_SEARCH_URL = f"{Config.GOOGLE_MAPS_URL}/maps/search"
+NOMINATIM_SEARCH_URL = f"{Config.NOMINATIM_URL}/search"
+DISTANCE_MATRIX_URL = f"{Config.GOOGLE_MAPS_API_URL}/maps/api/distancematrix/json"
+
 async def fetch(session, url, params=None, headers=None):
-    async with session.get(url, params=params, headers=headers) as response:
-        return await response.json()
+    #Distance Matrix JSON through its own limiter, raises upstream.TransientError
+    status, data = await upstream.get(session, "distance_matrix", url, params=params, headers=headers, read="json")
+    return data
 
+@metrics.timed("geocode.google_maps")
 async def get_coordinates_from_google_maps(session, address):
     #encodes the address to match for URL
     encoded_address = quote(address)
-    url = f"https://www.google.com/maps/search/{encoded_address}"
+    url = f"{GOOGLE_MAPS_SEARCH_URL}/{encoded_address}"
+    metrics.count("upstream.google_maps")
 
     try:
-        async with session.get(url) as response:
-            text = await response.text()
-            #search for coordinates by regex
-            pattern = re.compile(r"\[\s*3,\s*([0-9]+\.[0-9]+),\s*([0-9]+\.[0-9]+)\s*\]")
-            matches = pattern.findall(text)
-            if matches:
-                latitude, longitude = map(float, matches[0])
-                return longitude, latitude
+        status, text = await upstream.get(session, "google_maps", url)
+        #search for coordinates by regex
+        pattern = re.compile(r"\[\s*3,\s*([0-9]+\.[0-9]+),\s*([0-9]+\.[0-9]+)\s*\]")
+        matches = pattern.findall(text)
+        if matches:
+            latitude, longitude = map(float, matches[0])
+            return longitude, latitude
+    except upstream.TransientError:
+        raise
     except Exception:
         return None
     return None
 
+@metrics.timed("geocode.nominatim")
 async def get_coordinates_from_openstreetmap(session, address):
-    url = "https://nominatim.openstreetmap.org/search"
     params = {"q": address + ", ישראל", "format": "json"}
+    metrics.count("upstream.nominatim")
     #fake contact
     headers = {"User-Agent": "MyProject/1.0 (contact: SmartCart@example.com)"}
 
     try:
-        async with session.get(url, params=params, headers=headers) as response:
-            data = await response.json()
-            if data:
-                return float(data[0]["lat"]), float(data[0]["lon"])
+        #nominatim allows one request per second, its limiter spaces them
+        status, data = await upstream.get(session, "nominatim", NOMINATIM_SEARCH_URL, params=params, headers=headers, read="json")
+        if data:
+            return float(data[0]["lat"]), float(data[0]["lon"])
+    except upstream.TransientError:
+        raise
     except Exception:
         return None
     return None
 
-async def get_distance_from_google(origin, destinations):
-    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
+#Distance Matrix limits per request: 25 destinations and 100 elements (origins x destinations)
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+
+@metrics.timed("maps.distance_matrix")
+async def get_distance_chunk(session, origin, destinations):
     params = {
         "origins": origin,
         "destinations": "|".join(destinations),
@@ -60,54 +82,157 @@ async def get_distance_from_google(origin, destinations):
         "key": GOOGLE_MAPS_API_KEY
     }
 
-    async with aiohttp.ClientSession() as session:
-        data = await fetch(session, url, params=params)
+    metrics.count("upstream.distance_matrix")
+    metrics.count("upstream.distance_matrix.elements", len(destinations))
+    try:
+        data = await fetch(session, DISTANCE_MATRIX_URL, params=params)
+    except upstream.TransientError:
+        data = None
 
-    if data["status"] == "OK":
+    if isinstance(data, dict) and data.get("status") == "OK":
         distances = {}
         for i, destination in enumerate(destinations):
+            #a failed element is None, the rest of the chunk is kept
             element = data["rows"][0]["elements"][i]
             distances[destination] = element["distance"]["value"] / 1000 if element["status"] == "OK" else None
         return distances
     return {dest: None for dest in destinations}
 
-async def handle_fallback(session, cart_coords, store_address):
-    store_coords = await get_coordinates_from_openstreetmap(session, store_address)
-    if store_coords is None:
-        store_coords = await get_coordinates_from_google_maps(session, store_address)
+async def get_distance_from_google(origin, destinations):
+    #one origin: large destination lists are split into compliant chunks that run concurrently
+    destinations = list(dict.fromkeys(destinations))
+    chunk_size = min(MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST)
+    chunks = [destinations[i:i + chunk_size] for i in range(0, len(destinations), chunk_size)]
+
+    session = await httpClient.get_session()
+    results = await asyncio.gather(*[get_distance_chunk(session, origin, chunk) for chunk in chunks])
+
+    distances = {}
+    for chunk_distances in results:
+        distances.update(chunk_distances)
+    return distances
+
+#geocode key -> the task geocoding it right now
+GEOCODING = {}
+
+@metrics.timed("geocode.resolve")
+async def resolve_coordinates(session, address):
+    #the scraping geocoders, only for addresses the geocode store does not know yet
+    unanswered = False
+    try:
+        coords = await get_coordinates_from_openstreetmap(session, address)
+    except upstream.TransientError:
+        coords, unanswered = None, True
+    if coords is None:
+        try:
+            coords = await get_coordinates_from_google_maps(session, address)
+        except upstream.TransientError:
+            unanswered = True
+    #"not found" is remembered only when both geocoders answered, an outage is not an answer
+    if coords is not None or not unanswered:
+        await geocodeStore.save({address: coords})
+    return coords
+
+async def geocode(session, address, known=None):
+    #known: a lookup already made for this address, saves another database read
+    if known is None:
+        known = await geocodeStore.lookup([address])
+    if address in known:
+        return known[address]
+
+    key = geocodeStore.geocode_key(address)
+    task = GEOCODING.get(key)
+    if task is None:
+        task = asyncio.ensure_future(resolve_coordinates(session, address))
+        GEOCODING[key] = task
+        task.add_done_callback(lambda _: GEOCODING.pop(key, None))
+    return await asyncio.shield(task)
+
+@metrics.timed("distance.fallback")
+async def handle_fallback(session, cart_coords, store_addresses, known=None):
+    #geocode every store that fell back, then measure them all from the cart coordinates
+    #in as few matrix requests as possible instead of one request per store
+    store_coords = await asyncio.gather(*[
+        geocode(session, addr, known) for addr in store_addresses
+    ])
+
+    distances = {addr: None for addr in store_addresses}
+    if cart_coords is None:
+        return distances
 
-    if cart_coords is None or store_coords is None:
-        return store_address, None
-    
     lat1, lon1 = cart_coords
-    lat2, lon2 = store_coords
-
-    google_distance = await get_distance_from_google(f"{lat1},{lon1}", [f"{lat2},{lon2}"])
-    distance = google_distance.get(f"{lat2},{lon2}", None)
-    return store_address, distance
+    destinations = {
+        addr: f"{coords[0]},{coords[1]}"
+        for addr, coords in zip(store_addresses, store_coords)
+        if coords is not None
+    }
+    if destinations:
+        google_distances = await get_distance_from_google(f"{lat1},{lon1}", list(destinations.values()))
+        for addr, destination in destinations.items():
+            distances[addr] = google_distances.get(destination)
+    return distances
+
+#geocoding is not exact, a branch is pruned only this far past the limit
+PRUNE_MARGIN_KM = 0.5
+
+@metrics.timed("distance.prune")
+async def prune_far_addresses(cart_address, address_list, max_km):
+    #straight-line distance is a lower bound of the driving distance: a branch with known
+    #coordinates that is farther than max_km in a straight line is dropped before any API call
+    if not address_list:
+        return address_list
+
+    unknown = [addr for addr in address_list if geocodeStore.geocode_key(addr) not in branch_grid]
+    known = await geocodeStore.lookup([cart_address] + unknown)
+    for addr in unknown:
+        if known.get(addr) is not None:
+            branch_grid.add(geocodeStore.geocode_key(addr), *known[addr])
+    if not any(geocodeStore.geocode_key(addr) in branch_grid for addr in address_list):
+        return address_list
+
+    session = await httpClient.get_session()
+    cart_coords = await geocode(session, cart_address, known)
+    if cart_coords is None:
+        return address_list
+
+    nearby = branch_grid.within(*cart_coords, max_km + PRUNE_MARGIN_KM)
+    kept = [
+        addr for addr in address_list
+        if geocodeStore.geocode_key(addr) not in branch_grid or geocodeStore.geocode_key(addr) in nearby
+    ]
+    pruning_counters["checked"] += len(address_list)
+    pruning_counters["pruned"] += len(address_list) - len(kept)
+    return kept
 
 async def calculate_distances(cart_address, address_list):
-    async with aiohttp.ClientSession() as session:
-        distances = await get_distance_from_google(cart_address, address_list)
+    session = await httpClient.get_session()
+    distances = await get_distance_from_google(cart_address, address_list)
 
-        updated_distances = {}
-        cart_coords = None
+    updated_distances = {}
+    fallback_addresses = []
 
-        fallback_tasks = []
+    for addr, distance in distances.items():
+        if distance is None or distance > 10:
+            fallback_addresses.append(addr)
+        else:
+            updated_distances[addr] = distance
 
-        for addr, distance in distances.items():
-            if distance is None or distance > 10:
-                if (cart_coords is None):
-                    cart_coords = await get_coordinates_from_google_maps(session, cart_address)
-                fallback_tasks.append(handle_fallback(session, cart_coords, addr))
-            else:
-                updated_distances[addr] = distance
+    if fallback_addresses:
+        #one database read for every address the fallback needs
+        known = await geocodeStore.lookup([cart_address] + fallback_addresses)
+        cart_coords = await geocode(session, cart_address, known)
 
-        fallback_results = await asyncio.gather(*fallback_tasks)
-        for addr, distance in fallback_results:
-            updated_distances[addr] = distance
+        fallback_results = await handle_fallback(session, cart_coords, fallback_addresses, known)
+        updated_distances.update(fallback_results)
 
-        return [{"Address": addr, "Distance (km)": dist} for addr, dist in updated_distances.items()]
+    return [{"Address": addr, "Distance (km)": dist} for addr, dist in updated_distances.items()]
+
+async def calculate_distances_once(cart_address, address_list):
+    #for a single run from the command line: the shared client is closed before exiting
+    try:
+        return await calculate_distances(cart_address, address_list)
+    finally:
+        await httpClient.close()
 
 def decode_base64(encoded_str):
     decoded_bytes = base64.b64decode(encoded_str)
@@ -124,7 +249,7 @@ if __name__ == "__main__":
             print(json.dumps({"error": f"Failed to decode address list: {str(e)}"}), flush=True)
             sys.exit(1)
 
-        distances = asyncio.run(calculate_distances(cart_address, address_list))
+        distances = asyncio.run(calculate_distances_once(cart_address, address_list))
         output = {"distances": distances}
 
         print(json.dumps(output), flush=True)
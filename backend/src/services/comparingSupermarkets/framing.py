@@ -0,0 +1,102 @@
+import asyncio
+import json
+import struct
+import sys
+import threading
+
+#the channel between pythonManager.js and python_server, over stdin/stdout.
+#it starts as JSON lines; a first message {"type": "hello", "frames": true} switches both
+#directions to frames: a 4 byte big-endian length, then the message as compact JSON
+HEADER = struct.Struct(">I")
+#a JSON line can be as long as a whole cart
+LINE_LIMIT = 64 * 1024 * 1024
+
+def encode(message, framed):
+    if framed:
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+def decode(payload):
+    return json.loads(payload.decode("utf-8", errors="replace"))
+
+async def open_stdin():
+    #a StreamReader over stdin: a read pipe on the event loop where the platform allows it,
+    #otherwise (a regular file, some Windows consoles) a thread feeding the reader
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+        return reader
+    except (ValueError, OSError, NotImplementedError):
+        pass
+
+    def feed():
+        stdin = sys.stdin.buffer
+        while True:
+            chunk = stdin.read1(65536)
+            if not chunk:
+                break
+            loop.call_soon_threadsafe(reader.feed_data, chunk)
+        loop.call_soon_threadsafe(reader.feed_eof)
+
+    threading.Thread(target=feed, name="stdin-reader", daemon=True).start()
+    return reader
+
+class Channel:
+    #output: a binary file (stdout) or an asyncio StreamWriter (the stdin of a worker)
+    def __init__(self, reader, output=None):
+        self.reader = reader
+        self.output = output or sys.stdout.buffer
+        self.framed = False  #False: JSON lines
+
+    async def read(self):
+        #the next message, None at the end of the input. a message that does not decode raises
+        #ValueError, the frame boundaries are kept so the next read goes on
+        if not self.framed:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    return None
+                if line.strip():
+                    break
+            message = decode(line.strip())
+        else:
+            try:
+                header = await self.reader.readexactly(HEADER.size)
+                payload = await self.reader.readexactly(HEADER.unpack(header)[0])
+            except asyncio.IncompleteReadError:
+                return None
+            try:
+                message = decode(payload)
+            except Exception as e:
+                raise ValueError(f"bad frame: {e}")
+
+        if not isinstance(message, dict):
+            raise ValueError("request must be an object")
+        return message
+
+    def write(self, message):
+        body = encode(message, self.framed)
+        if self.framed:
+            body = HEADER.pack(len(body)) + body
+        self.output.write(body)
+        flush = getattr(self.output, "flush", None)
+        if flush is not None:
+            flush()
+
+    def accept_hello(self, data):
+        #the hello is answered as a JSON line, the messages after it are frames if both sides want them
+        framed = data.get("frames") is True
+        reply = {"type": "hello", "frames": framed}
+        if data.get("id") is not None:
+            reply = {"id": data["id"], **reply}
+        self.write(reply)
+        self.framed = framed
+
+    async def offer_hello(self):
+        #the client side of accept_hello, before any other message is sent
+        self.write({"type": "hello", "frames": True, "id": "hello"})
+        reply = await self.read()
+        if reply is None:
+            raise ConnectionError("the other side closed before the hello")
+        self.framed = reply.get("frames") is True
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+import dbAccess
+import metrics
+from cache import TTLCache
+from addressKey import address_key
+
+#supermarket branches almost never move, an address that failed is tried again sooner
+FOUND_TTL = 365 * 24 * 60 * 60
+NOT_FOUND_TTL = Config.GEOCODE_NEGATIVE_TTL_DAYS * 24 * 60 * 60
+
+#address key -> (lat, lon), or NOT_FOUND for an address that could not be geocoded
+NOT_FOUND = "not found"
+geocode_cache = TTLCache(Config.GEOCODE_CACHE_SIZE, FOUND_TTL)
+
+def geocode_key(address):
+    return address_key(address)
+
+def geocode_stats():
+    return geocode_cache.stats()
+
+async def lookup(addresses):
+    #address -> (lat, lon) or None for every address already geocoded, unknown addresses are left out
+    known = {}
+    missing = {}
+    for address in addresses:
+        key = geocode_key(address)
+        coords = geocode_cache.get(key)
+        if coords is None:
+            missing.setdefault(key, []).append(address)
+        else:
+            known[address] = None if coords == NOT_FOUND else coords
+
+    metrics.count("cache.geocodes.hits", len(known))
+    metrics.count("cache.geocodes.misses", sum(len(group) for group in missing.values()))
+    if missing:
+        now = datetime.utcnow()
+        for doc in await dbAccess.find_geocodes(list(missing), now):
+            coords = (doc["lat"], doc["lon"]) if doc.get("found") else NOT_FOUND
+            geocode_cache.set(doc["address"], coords, (doc["expires_at"] - now).total_seconds())
+            for address in missing[doc["address"]]:
+                known[address] = None if coords == NOT_FOUND else coords
+    return known
+
+async def save(results):
+    #results: address -> (lat, lon), or None when no geocoder could resolve it
+    now = datetime.utcnow()
+    operations = []
+    for address, coords in results.items():
+        key = geocode_key(address)
+        ttl = FOUND_TTL if coords is not None else NOT_FOUND_TTL
+        geocode_cache.set(key, coords if coords is not None else NOT_FOUND, ttl)
+        operations.append(UpdateOne(
+            {"address": key},
+            {"$set": {
+                "lat": coords[0] if coords is not None else None,
+                "lon": coords[1] if coords is not None else None,
+                "found": coords is not None,
+                "last_updated": now,
+                "expires_at": now + timedelta(seconds=ttl),
+            }},
+            upsert=True
+        ))
+    try:
+        await dbAccess.write_geocodes(operations)
+    except BulkWriteError:
+        #another worker upserted the same address first, the unique index kept its document
+        pass
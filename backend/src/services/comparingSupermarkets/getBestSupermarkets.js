@@ -9,7 +9,9 @@ startPythonServer();
 const getBestSupermarkets = async (req, res) => {
   try {
     const { cartKey } = req.params;
-    const { address, alpha = 0.5 } = req.body;
+    //session: the token of an earlier comparison of this cart, moving the alpha slider
+    //ranks it again without comparing the cart again
+    const { address, alpha = 0.5, session } = req.body;
 
     if (!cartKey || !address) {
       return res.status(400).json({ error: "Missing cartKey or address" });
@@ -68,13 +70,28 @@ const getBestSupermarkets = async (req, res) => {
       cart[item.name] = item.quantity;
     }
 
-    const pythonOutput = await sendToPython({
-      cart: cart,
-      address: address,
-      alpha: alpha,
-    });
+    let pythonOutput = null;
+    if (session) {
+      //expired, or the cart changed since: compared again below
+      const rescored = await sendToPython({
+        type: "rescore",
+        session: session,
+        alpha: alpha,
+        cart: cart,
+        address: address,
+      });
+      if (!rescored.error) pythonOutput = rescored;
+    }
+    if (!pythonOutput) {
+      pythonOutput = await sendToPython({
+        cart: cart,
+        address: address,
+        alpha: alpha,
+        session: true,
+      });
+    }
 
-    const { supermarkets, recommendations } = pythonOutput;
+    const { supermarkets, recommendations, frontier } = pythonOutput;
     if (!supermarkets) {
       return res
         .status(400)
@@ -84,6 +101,8 @@ const getBestSupermarkets = async (req, res) => {
         supermarkets: [],
         recommendations,
         product_images: product_images_list,
+        session: pythonOutput.session,
+        frontier,
       });
     }
 
@@ -106,6 +125,8 @@ const getBestSupermarkets = async (req, res) => {
       supermarkets: supermarketsWithLogos,
       recommendations,
       product_images: product_images_list,
+      session: pythonOutput.session,
+      frontier,
     });
   } catch (error) {
     console.log(error);
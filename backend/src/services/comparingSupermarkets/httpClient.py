@@ -0,0 +1,42 @@
+import asyncio
+import aiohttp
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+
+#one long-lived session for the whole process: CHP scraping, Distance Matrix and geocoding
+#reuse its keep-alive connections instead of paying DNS, TCP and TLS on every request
+_session = None
+
+def create_connector():
+    return aiohttp.TCPConnector(
+        limit=Config.HTTP_POOL_SIZE,
+        limit_per_host=Config.HTTP_POOL_PER_HOST,
+        ttl_dns_cache=Config.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=Config.HTTP_KEEPALIVE_TIMEOUT,
+    )
+
+async def start():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=create_connector(),
+            timeout=aiohttp.ClientTimeout(total=Config.HTTP_TIMEOUT),
+        )
+    return _session
+
+async def get_session():
+    #python_server starts the pool at startup, scripts get it on first use
+    if _session is None or _session.closed:
+        return await start()
+    return _session
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        #let the SSL transports finish closing before the loop goes away
+        await asyncio.sleep(0.25)
+    _session = None
@@ -1,126 +1,168 @@
-import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-import pandas as pd
-from itertools import combinations
+import heapq
+import time
+import numpy as np
 from collections import defaultdict
-import re
 from pymongo import UpdateOne
-from datetime import datetime, timezone
+from datetime import datetime
 import sys
 import os
 
-"""
-import time
-from functools import wraps
-
-def measure_time(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"{func.__name__} took {elapsed_time:.4f} seconds")
-        return result
-    return wrapper
-"""
-
-SEMAPHORE = asyncio.Semaphore(30)
-
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
-from src.db.index import get_db
-
-db = get_db()
-find_stores = db["findStores"]
-find_prices = db["findPrices"]
-not_found = db["notFoundStores"]
-
-
-def parse_discount_text(discount_text):
-    required_quantity = 1
-    match = re.search(r"(?:(\d+) יחידות ב|קנה אחד, קבל את השני ב)|(\d+\.\d+) ש״ח", discount_text)
-    
-    if match:
-        if match.group(1):  # match to quantity
-            required_quantity = int(match.group(1))
-        elif "קנה אחד, קבל את השני ב" in discount_text:
-            required_quantity = 2
-    
-    return required_quantity
-
-async def fetch_store_data(session, product_name, shopping_address):
-    async with SEMAPHORE:
-        url = "https://chp.co.il/main_page/compare_results"
-        params = {"shopping_address": shopping_address, "product_name_or_barcode": product_name}
-
-        async with session.get(url, params=params) as response:
-            if response.status != 200:
-                return None
-
-            soup = BeautifulSoup(await response.text(), "html.parser")
-            table = soup.find("table", {"class": "table results-table"})
-            if not table:
-                return None
-
-            stores = {}
-            for row in table.find_all("tr")[1:]:  # skip titles
-                cols = [col.text.strip() for col in row.find_all("td")]
-                if len(cols) >= 4:
-                    store_name, address = cols[0], cols[2]
-                    regular_price = cols[-1]
-                    sale_price = re.sub(r"[^\d.]", "", cols[-2])  # only numbers and "."
-                    required_quantity = None
-                    discount_button = row.find("button", class_="btn-discount")
-                    if discount_button:
-                        discount_text = discount_button["data-discount-desc"]
-                        required_quantity = parse_discount_text(discount_text)
-                            
-                    stores[(store_name, address)] = {
-                        "Regular Price": float(regular_price) if regular_price else None,
-                        "Sale Price": float(sale_price) if sale_price else None,
-                        "Required Quantity": required_quantity,
-                        "Last Updated": datetime.now(timezone.utc),
-                    }
-
-        return stores
-
-def filterStores(store_data, product_list):
-    filtered_data = defaultdict(dict)
-    stores_missing_products = defaultdict(set)
-
-    # change the structure of the store_data
-    store_to_products = defaultdict(dict)
-    for product, stores in store_data.items():
-        for (store, address), data in stores.items():
-            store_to_products[(store, address)][product] = data
-
-    for (store, address), products in store_to_products.items():
-        missing_products = set(product_list) - set(products.keys())
-
-        if missing_products:
-            for product in missing_products:
-                stores_missing_products[product].add((store, address))
-        else:
-            filtered_data[(store, address)] = products
-    return dict(filtered_data), dict(stores_missing_products)
-
-
-def recommendedToRemove(store_data, stores_missing_products, product_list):
-    problematic_products = list(stores_missing_products.keys())
-    
-    for r in range(1, len(problematic_products)):
-        for combo in combinations(problematic_products, r):
-            remaining_products = [p for p in product_list if p not in combo]
-            
-            #amount of supermarket branches that sells the remaining_products
-            temp_filtered_data, _ = filterStores(store_data, remaining_products)
-            new_store_count = len(temp_filtered_data)
-            
-            if new_store_count >= 5:
-                return list(combo)
-
-    return []
+import dbAccess
+import httpClient
+import metrics
+import upstream
+import cpuPool
+from chpParser import parse_results_table
+from storeCoverage import CoverageIndex
+from addressKey import address_key
+from pricing import PriceMatrix
+from cache import TTLCache
+from priceRefresher import accesses, chp_budget
+from src.config import Config
+
+#same expiry windows as the findStores and findPrices collections
+STORES_TTL = 20 * 24 * 60 * 60
+PRICES_TTL = 3 * 24 * 60 * 60
+
+CHP_COMPARE_URL = f"{Config.CHP_URL}/main_page/compare_results"
+
+#(address_key(cart_address), product) -> [(storeName, address)]
+stores_cache = TTLCache(Config.STORES_CACHE_SIZE, STORES_TTL)
+#(product, storeName, address) -> {regular_price, sale_price, required_quantity, last_updated}
+prices_cache = TTLCache(Config.PRICES_CACHE_SIZE, PRICES_TTL)
+
+
+def cache_stats():
+    return {"stores": stores_cache.stats(), "prices": prices_cache.stats()}
+
+def fetch_key(product_name, shopping_address):
+    #the same product in the same area is the same CHP request, whatever the spelling of the address
+    return " ".join(product_name.split()), address_key(shopping_address)
+
+#fetch_key -> the task fetching it right now, shared by every cart that asks for it
+INFLIGHT_FETCHES = {}
+fetch_counters = {"requests": 0, "coalesced": 0}
+
+def fetch_stats():
+    return dict(fetch_counters)
+
+async def fetch_store_data(session, product_name, shopping_address, prepaid=False):
+    #prepaid: the caller already took a token of chp_budget for this request
+    key = fetch_key(product_name, shopping_address)
+    task = INFLIGHT_FETCHES.get(key)
+    if task is None:
+        fetch_counters["requests"] += 1
+        if not prepaid:
+            chp_budget.spend()
+        task = asyncio.ensure_future(_fetch_store_data(session, product_name, shopping_address))
+        INFLIGHT_FETCHES[key] = task
+        task.add_done_callback(lambda _: INFLIGHT_FETCHES.pop(key, None))
+    else:
+        fetch_counters["coalesced"] += 1
+
+    #shield: one caller giving up must not cancel the fetch the others wait for
+    return await asyncio.shield(task)
+
+async def _fetch_store_data(session, product_name, shopping_address):
+    #{} when CHP has no store for the product, None when it did not answer:
+    #a failed fetch is not an answer and is never cached
+    params = {"shopping_address": shopping_address, "product_name_or_barcode": product_name}
+
+    metrics.count("upstream.chp")
+    try:
+        #the chp limiter adapts how many pages are fetched at the same time, and retries 429/5xx
+        with metrics.span("chp.fetch"):
+            status, html = await upstream.get(session, "chp", CHP_COMPARE_URL, params=params)
+    except upstream.TransientError:
+        return None
+    if status != 200:
+        metrics.count("upstream.chp.failed")
+        return None
+
+    #only the results table is tokenized, not the whole page. the limiter slot is already free,
+    #the page is parsed on the parse pool while the next ones are fetched
+    with metrics.span("chp.parse"):
+        return await cpuPool.parse(parse_results_table, html) or {}
+
+#search budget of recommendedToRemove, past it the best removal found so far is returned
+RECOMMEND_MAX_NODES = 20000
+RECOMMEND_TIME_BUDGET = 0.05  #seconds
+RECOMMEND_MIN_STORES = 5
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+def coveredStores(counts, masks, removed):
+    #stores that sell everything except the removed products
+    return counts.get(0, 0) + sum(counts[m] for m in masks if m & ~removed == 0)
+
+def removalOrder(mask):
+    #order of itertools.combinations: the set with the smaller product indices comes first
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+def greedyRemoval(masks, needed):
+    #upper bound: let in one store at a time, the one that adds the fewest products to remove
+    removed = 0
+    for _ in range(needed):
+        candidates = [m for m in masks if m | removed != removed]
+        if not candidates:
+            break
+        removed |= min(candidates, key=lambda m: popcount(m & ~removed))
+    return removed
+
+@metrics.timed("recommend")
+def recommendedToRemove(coverage):
+    problematic_products = coverage.problematic_products()
+    n = len(problematic_products)
+    #masks are over the cart products, their order keeps the order of the problematic ones
+    counts = coverage.missing_counts()
+
+    if sum(counts.values()) < RECOMMEND_MIN_STORES:
+        return []
+    if counts.get(0, 0) >= RECOMMEND_MIN_STORES:
+        #enough stores without removing anything, the first product is the first combination
+        return problematic_products[:1] if n > 1 else []
+
+    #a minimal removal is always the union of the missing products of the stores it lets in,
+    #so the search runs over unions of masks, smallest first, instead of every combination
+    best = greedyRemoval([m for m in counts if m], RECOMMEND_MIN_STORES - counts.get(0, 0))
+    best_size = popcount(best)
+    #a store missing more products than the best removal can never be part of a better one
+    masks = [m for m in counts if m and popcount(m) <= best_size]
+
+    deadline = time.monotonic() + RECOMMEND_TIME_BUDGET
+    visited = {0}
+    queue = [(0, 0)]  #(size, removed)
+    nodes = 0
+    while queue:
+        nodes += 1
+        if nodes > RECOMMEND_MAX_NODES or time.monotonic() > deadline:
+            break
+        size, removed = heapq.heappop(queue)
+        if size >= best_size:
+            break
+        for mask in masks:
+            union = removed | mask
+            if union in visited:
+                continue
+            visited.add(union)
+            union_size = popcount(union)
+            if union_size > best_size:
+                continue
+            if coveredStores(counts, masks, union) >= RECOMMEND_MIN_STORES:
+                #smaller, or as small and earlier in combinations order
+                if union_size < best_size or removalOrder(union) < removalOrder(best):
+                    best, best_size = union, union_size
+                    masks = [m for m in masks if popcount(m) <= best_size]
+            elif union_size < best_size:
+                heapq.heappush(queue, (union_size, union))
+
+    #like the combinations search, never recommend removing every problematic product
+    if best_size >= n:
+        return []
+    return [coverage.products[i] for i in removalOrder(best)]
 
 def clean_address(address):
     address = address.strip()
@@ -129,20 +171,26 @@ def clean_address(address):
     address = address.rstrip(", ").strip()
     return address
 
-def storesFromDB(shopping_address, products):
-    docs = list(find_stores.find({
-        "cart_address": shopping_address,
-        "product_name": {"$in": products}
-    }))
-    return {d["product_name"]: d["stores"] for d in docs}
-
-
-async def updateMissingStores(session, shopping_address, missing_products):
-    now = datetime.utcnow()
-    new_lists = {}
-    bulkStores = []
-    bulkPrices = []
-
+async def storesFromDB(cart_key, products):
+    store_lists = {}
+    for p in products:
+        stores = stores_cache.get((cart_key, p))
+        if stores is not None:
+            store_lists[p] = stores
+
+    #only the products that are not in memory are read from the database
+    missing = [p for p in products if p not in store_lists]
+    metrics.count("cache.stores.hits", len(store_lists))
+    metrics.count("cache.stores.misses", len(missing))
+    if missing:
+        docs = await dbAccess.find_store_lists(cart_key, missing)
+        for d in docs:
+            store_lists[d["product_name"]] = d["stores"]
+            stores_cache.set_from_document((cart_key, d["product_name"]), d["stores"], d.get("last_updated"))
+    return store_lists
+
+
+async def updateMissingStores(session, shopping_address, cart_key, missing_products, fetched):
     #fetch from CHP
     #stores: {(storeName, address) → {Regular Price, Sale Price, Required Quantity}}
     tasks = {
@@ -150,9 +198,21 @@ async def updateMissingStores(session, shopping_address, missing_products):
       for p in missing_products
     }
     results = await asyncio.gather(*tasks.values())
-    
-    for p, stores in zip(tasks.keys(), results):
-        stores = stores or {}
+
+    #products CHP did not answer for stay unknown: not written, asked again by the next request
+    results = {p: stores for p, stores in zip(tasks.keys(), results) if stores is not None}
+    #kept for updateMissingPrices, the page already has the prices of every store
+    fetched.update(results)
+    return await saveFetchedStores(cart_key, results)
+
+async def saveFetchedStores(cart_key, results):
+    #results: product -> CHP results in the cart area, written to findStores and findPrices
+    now = datetime.utcnow()
+    new_lists = {}
+    bulkStores = []
+    bulkPrices = []
+
+    for p, stores in results.items():
         #the selling stores without http (no websites)
         sellingStores = [
             (sn, addr)
@@ -160,47 +220,70 @@ async def updateMissingStores(session, shopping_address, missing_products):
             if "http" not in addr.lower()
         ]
         new_lists[p] = sellingStores
+        stores_cache.set((cart_key, p), sellingStores)
 
         #update findStore in database
         bulkStores.append(UpdateOne(
-            {"cart_address": shopping_address, "product_name": p},
+            {"cart_address": cart_key, "product_name": p},
             {"$set": {"stores": sellingStores, "last_updated": now}},
             upsert=True
         ))
         #update findPrice in database
         for (sn, addr), prices in stores.items():
+            price = {
+                "regular_price": prices["Regular Price"],
+                "sale_price":   prices["Sale Price"],
+                "required_quantity": prices["Required Quantity"],
+                "last_updated": now
+            }
+            prices_cache.set((p, sn, addr), price)
             bulkPrices.append(UpdateOne(
                 {"product_name": p, "store_name": sn, "store_address": addr},
-                {"$set": {
-                    "regular_price": prices["Regular Price"],
-                    "sale_price":   prices["Sale Price"],
-                    "required_quantity": prices["Required Quantity"],
-                    "last_updated": now
-                }},
+                {"$set": price},
                 upsert=True
             ))
     
-    if bulkPrices:
-        find_prices.bulk_write(bulkPrices)
-    if bulkStores:
-        find_stores.bulk_write(bulkStores)
+    await dbAccess.write_prices(bulkPrices)
+    await dbAccess.write_store_lists(bulkStores)
     return new_lists
 
-def pricesFromDB(products, sellingAllStores):
-    findFromDB = list(find_prices.find({ "product_name": {"$in": products} }))
+async def pricesFromDB(products, sellingAllStores):
+    prices = {}
+    missing = []
+    for p in products:
+        cached = {}
+        for sn, addr in sellingAllStores:
+            price = prices_cache.get((p, sn, addr))
+            if price is None:
+                break
+            cached[(p, sn, addr)] = price
+        else:
+            prices.update(cached)
+            continue
+        #a product with any store missing in memory is read from the database
+        missing.append(p)
+
+    metrics.count("cache.prices.hits", len(products) - len(missing))
+    metrics.count("cache.prices.misses", len(missing))
+    if not missing:
+        return prices
+
+    findFromDB = await dbAccess.find_product_prices(missing)
 
     #only the ones in sellingAllStores
     allowed = set(sellingAllStores)
-    prices = {}
     for db in findFromDB:
         key = (db["product_name"], db["store_name"], db["store_address"])
+        prices_cache.set_from_document(key, db, db.get("last_updated"))
         if (db["store_name"], db["store_address"]) in allowed:
             prices[key] = db
 
     return prices
 
 
-async def updateMissingPrices(session, shopping_address, products, sellingStores, prices):
+async def updateMissingPrices(session, shopping_address, products, sellingStores, prices, fetched, on_product=None):
+    #on_product(prices, remaining) is awaited after the prices of each fetched product are in
+    #prices, remaining: the product pages still on their way
     now = datetime.utcnow()
     
     to_fetch_map = defaultdict(list)
@@ -209,15 +292,9 @@ async def updateMissingPrices(session, shopping_address, products, sellingStores
             if (p, sn, addr) not in prices:
                 to_fetch_map[p].append((sn, addr))
 
-    tasks = {
-        p: fetch_store_data(session, p, shopping_address)
-        for p in to_fetch_map
-    }
-    results = await asyncio.gather(*tasks.values())
-
-
-    for p, stores in zip(tasks.keys(), results):
-        stores = stores or {}
+    bulkPrices = []
+    def fill(p):
+        stores = fetched[p] or {}
         for sn, addr in to_fetch_map[p]:
             data = stores.get((sn, addr))
             if not data or "http" in addr.lower():
@@ -228,84 +305,217 @@ async def updateMissingPrices(session, shopping_address, products, sellingStores
                 "required_quantity": data["Required Quantity"],
                 "last_updated": now
             }
+            prices_cache.set((p, sn, addr), prices[(p, sn, addr)])
 
-            find_prices.update_one(
+            bulkPrices.append(UpdateOne(
                 {"product_name": p, "store_name": sn, "store_address": addr},
                 {"$set": prices[(p, sn, addr)]},
                 upsert=True
-            )
+            ))
+
+    #products fetched by updateMissingStores in this request are not fetched again
+    for p in to_fetch_map:
+        if p in fetched:
+            fill(p)
+
+    async def fetch(p):
+        return p, await fetch_store_data(session, p, shopping_address)
+
+    #the prices of each product are taken as its page lands, not once every page is in
+    tasks = [fetch(p) for p in to_fetch_map if p not in fetched]
+    for remaining, task in enumerate(asyncio.as_completed(tasks), 1):
+        p, stores = await task
+        fetched[p] = stores
+        fill(p)
+        if on_product is not None:
+            await on_product(prices, len(tasks) - remaining)
+
+    #one round trip for all the fetched prices
+    await dbAccess.write_prices(bulkPrices)
     return prices
 
-async def get_store_data(shopping_address, cart_quantities):
+async def refresh_entry(cart_key, shopping_address, product):
+    #fetch one (area, product) again before it expires, a failed fetch keeps what is cached
+    session = await httpClient.get_session()
+    stores = await fetch_store_data(session, product, shopping_address, prepaid=True)
+    if stores is None:
+        return False
+    await saveFetchedStores(cart_key, {product: stores})
+    return True
+
+def entry_expires_in(cart_key, product):
+    #the store list and the prices of its stores are refreshed by the same CHP page,
+    #so the entry expires with the first of them
+    entry = stores_cache.peek((cart_key, product))
+    if entry is None:
+        return None
+    expires_in, stores = entry
+    for sn, addr in stores:
+        price = prices_cache.peek((product, sn, addr))
+        if price is not None:
+            expires_in = min(expires_in, price[0])
+    return expires_in
+
+class SharedLookups:
+    #what the carts of one batch in the same area look up once: the CHP pages fetched for the
+    #batch, the products CHP does not know there and the distances of the branches
+    def __init__(self):
+        self.fetched = {}  #product -> CHP results, like the fetched of a single request
+        self.not_found = set()
+        self.distances = {}  #branch address -> km
+        self.measured = set()  #branch addresses whose distance was looked up, found or not
+
+async def prefetch_area(shopping_address, carts):
+    #carts: the product lists of the batch items in one area. the store lists of every product are
+    #read (and fetched from CHP) once, then each cart finds them in memory.
+    #returns the SharedLookups and the stores that sell the whole of at least one cart
+    shopping_address = clean_address(shopping_address)
+    cart_key = address_key(shopping_address)
+    products = list(dict.fromkeys(p for cart in carts for p in cart))
+    shared = SharedLookups()
+    session = await httpClient.get_session()
+
+    store_lists, not_found_docs = await asyncio.gather(
+        storesFromDB(cart_key, products),
+        dbAccess.find_not_found(cart_key),
+    )
+    shared.not_found = {doc["productId"] for doc in not_found_docs}
+    missing_products = [p for p in products if p not in store_lists and p not in shared.not_found]
+    if missing_products:
+        store_lists.update(await updateMissingStores(session, shopping_address, cart_key, missing_products, shared.fetched))
+
+    candidates = set()
+    for cart in carts:
+        coverage = CoverageIndex(store_lists, list(cart))
+        candidates.update(store for store in coverage.stores_selling_all() if "http" not in store[1].lower())
+    return shared, sorted(candidates)
+
+@metrics.timed("pricing.build_matrix")
+def build_price_matrix(sellingStores, products, prices, cart_quantities):
+    regular = np.full((len(sellingStores), len(products)), np.nan)
+    sale = np.full_like(regular, np.nan)
+    required = np.full_like(regular, np.nan)
+    complete = np.ones(len(sellingStores), dtype=bool)
+
+    for i, (sn, addr) in enumerate(sellingStores):
+        for j, p in enumerate(products):
+            price = prices.get((p, sn, addr))
+            if not price:
+                #a store without the price of one of the products is not compared
+                complete[i] = False
+                break
+            regular[i, j] = np.nan if price["regular_price"] is None else price["regular_price"]
+            sale[i, j] = np.nan if price["sale_price"] is None else price["sale_price"]
+            required[i, j] = np.nan if price["required_quantity"] is None else price["required_quantity"]
+
+    stores = [store for store, keep in zip(sellingStores, complete) if keep]
+    quantities = np.array([cart_quantities[p] for p in products], dtype=float)
+    return PriceMatrix(stores, products, regular[complete], sale[complete], required[complete], quantities)
+
+async def get_store_data(shopping_address, cart_quantities, on_partial=None, store_filter=None, shared=None):
+    #on_partial(price_matrix, stage) gets the rankable stores before the full matrix is returned:
+    #"provisional" with the prices from the database alone, then "refined" each time a fetched
+    #CHP page completes more stores while other pages are still on their way.
+    #store_filter(stores) -> the stores worth pricing, of the ones selling the whole cart.
+    #shared: the SharedLookups of a batch (prefetch_area), None for a single cart
     shopping_address = clean_address(shopping_address)
+    #CHP gets the address as typed, the caches are keyed by its canonical form
+    cart_key = address_key(shopping_address)
     products = list(cart_quantities.keys())
-
-    async with aiohttp.ClientSession() as session:
-        #import stores from the database per product in the cart area
-        #{(storeName, address) → {Regular Price, Sale Price, Required Quantity}}
-        store_lists = storesFromDB(shopping_address, products)
-
-        not_found_docs = list(not_found.find({
-            "cart_address": shopping_address
-        }))
+    for p in products:
+        accesses.touch((cart_key, p), shopping_address)
+
+    session = await httpClient.get_session()
+
+    #import stores from the database per product in the cart area
+    #{(storeName, address) → {Regular Price, Sale Price, Required Quantity}}
+    #the two reads are independent, so they run at the same time
+    if shared is not None:
+        store_lists = await storesFromDB(cart_key, products)
+        not_found_set = shared.not_found
+    else:
+        store_lists, not_found_docs = await asyncio.gather(
+            storesFromDB(cart_key, products),
+            dbAccess.find_not_found(cart_key),
+        )
         not_found_set = {doc["productId"] for doc in not_found_docs}
 
-        #fetch stores from CHP if not in the database
-        missing_products = [
-            p for p in products
-            if p not in store_lists and p not in not_found_set
-        ]
-
-        if missing_products:
-            #product -> list of (store, address)
-            new_lists = await updateMissingStores(session, shopping_address, missing_products)
-            store_lists.update(new_lists)
-
-
-        #find the stores that selling all the products
-        store_data = {
-            p: {tuple(s): None for s in store_lists[p]}
-            for p in products
-        }
-        filtered_data, stores_missing = filterStores(store_data, products)
-        #without http (no websites)
-        sellingAllStores = [
-            (sn, addr)
-            for sn, addr in filtered_data.keys()
-            if "http" not in addr.lower()
-        ]
+    #fetch stores from CHP if not in the database
+    missing_products = [
+        p for p in products
+        if p not in store_lists and p not in not_found_set
+    ]
+
+    #product -> CHP results fetched during this request (or batch)
+    fetched = shared.fetched if shared is not None else {}
+    if missing_products:
+        #product -> list of (store, address)
+        new_lists = await updateMissingStores(session, shopping_address, cart_key, missing_products, fetched)
+        store_lists.update(new_lists)
+
+
+    #find the stores that selling all the products
+    coverage = CoverageIndex(store_lists, products)
+    #without http (no websites)
+    sellingAllStores = [
+        (sn, addr)
+        for sn, addr in coverage.stores_selling_all()
+        if "http" not in addr.lower()
+    ]
+    #e.g. the branches too far away: no price of theirs is read or fetched
+    filtered_out = 0
+    if store_filter is not None and sellingAllStores:
+        kept = await store_filter(sellingAllStores)
+        filtered_out = len(sellingAllStores) - len(kept)
+        sellingAllStores = kept
+
+    #find the prices from the database
+    prices = await pricesFromDB(products, sellingAllStores)
+
+    #the store lists came from the database, so the stores priced so far are a useful first answer.
+    #it runs next to the price fetches and is done before the full matrix is returned
+    provisional = None
+    ranked_rows = 0
+    if on_partial is not None and not missing_products and len(prices) < len(products) * len(sellingAllStores):
+        cached_matrix = build_price_matrix(sellingAllStores, products, prices, cart_quantities)
+        if len(cached_matrix):
+            ranked_rows = len(cached_matrix)
+            provisional = asyncio.ensure_future(on_partial(cached_matrix, "provisional"))
+
+    on_product = None
+    if on_partial is not None:
+        async def on_product(prices, remaining):
+            #the last page is followed by the full matrix anyway
+            nonlocal ranked_rows
+            if not remaining:
+                return
+            matrix = build_price_matrix(sellingAllStores, products, prices, cart_quantities)
+            if len(matrix) > ranked_rows:
+                ranked_rows = len(matrix)
+                #after the provisional ranking, never before it
+                if provisional is not None:
+                    await provisional
+                await on_partial(matrix, "refined")
+
+    #fetch prices if not in the database
+    try:
+        prices = await updateMissingPrices(
+            session, shopping_address, products, sellingAllStores, prices, fetched, on_product)
+    finally:
+        if provisional is not None:
+            await provisional
+    
+    #stores x products arrays of the stores that have a price for every product
+    price_matrix = build_price_matrix(sellingAllStores, products, prices, cart_quantities)
 
-        #find the prices from the database
-        prices = pricesFromDB(products, sellingAllStores)
+    #optimization suggestion if less then 5 supermarkets is suggesting.
+    #the coverage is over every store, so the stores filtered out still count as selling the
+    #whole cart, as they did when they were priced and dropped afterwards
+    recommended_removals = []
+    if len(price_matrix) + filtered_out < 5:
+        recommended_removals = recommendedToRemove(coverage)
 
-        #fetch prices if not in the database
-        prices = await updateMissingPrices(session, shopping_address, products, sellingAllStores, prices)
-        
-        #build Dataframe
-        records = []
-        for sn, addr in sellingAllStores:
-            row = {"Store": sn, "Address": addr}
-            for p in products:
-                price = prices.get((p, sn, addr))
-                if not price:
-                    break
-                qty = cart_quantities[p]
-                req = price["required_quantity"]
-                row[p] = price["sale_price"] if req and qty >= req else price["regular_price"]
-                row[f"{p} (Regular Price)"] = price["regular_price"]
-                row[f"{p} (Sale Price)"] = price["sale_price"]
-                row[f"{p} (Required Quantity)"] = req
-            else:
-                records.append(row)
-
-        #optimization suggestion if less then 5 supermarkets is suggesting
-        recommended_removals = []
-        if len(records) < 5:
-            recommended_removals = recommendedToRemove(
-                store_data, stores_missing, products
-            )
-
-    return pd.DataFrame(records), recommended_removals
+    return price_matrix, recommended_removals
 
 """
 if __name__ == "__main__":
@@ -313,11 +523,11 @@ if __name__ == "__main__":
         shopping_address = "יששכר 1, נתניה"
         cart_quantities = {"שוקולד חלב במילוי קרם ווניל ושבבי עוגיות אוראו, 100 גרם": 1,
                            "חלב תנובה טרי 3% בקרטון, 1 ליטר": 6,}
-        df, recommended_removals = asyncio.run(
+        price_matrix, recommended_removals = asyncio.run(
             get_store_data(shopping_address, cart_quantities)
         )
-        # Save to CSV file
-        df.to_csv('store_comparison_data.csv', index=False, encoding='utf-8-sig')
+        for store, regular in zip(price_matrix.stores, price_matrix.regular):
+            print(store, regular)
         
         print("Done")
     except Exception as e:
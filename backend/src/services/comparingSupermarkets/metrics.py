@@ -0,0 +1,128 @@
+import time
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+#always-on instrumentation of the comparison pipeline: spans (how long and how often) and counters,
+#totaled for the whole process and per request. every request of python_server runs in its own
+#task, so the request it belongs to is found through a context variable
+
+class RequestMetrics:
+    #span times are summed over calls, concurrent calls (e.g. the CHP fetches of a cart)
+    #can add up to more than the total time of the request
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}  #name -> [count, seconds]
+        self.counters = {}
+
+    def report(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": {
+                name: {"count": count, "ms": round(seconds * 1000, 2)}
+                for name, (count, seconds) in self.spans.items()
+            },
+            "counters": dict(self.counters),
+            "cache_hit_ratio": hit_ratios(self.counters),
+        }
+
+_request = ContextVar("request_metrics", default=None)
+span_totals = {}  #name -> [count, seconds, max seconds]
+counter_totals = {}
+requests = {"count": 0}
+
+def start_request():
+    #the tasks the request starts from here on report to it too
+    metrics = RequestMetrics()
+    _request.set(metrics)
+    return metrics
+
+def finish_request(metrics):
+    requests["count"] += 1
+    record("request", time.perf_counter() - metrics.started)
+    return metrics.report()
+
+def record(name, seconds):
+    total = span_totals.get(name)
+    if total is None:
+        span_totals[name] = [1, seconds, seconds]
+    else:
+        total[0] += 1
+        total[1] += seconds
+        if seconds > total[2]:
+            total[2] = seconds
+
+    metrics = _request.get()
+    if metrics is not None and name != "request":
+        span = metrics.spans.get(name)
+        if span is None:
+            metrics.spans[name] = [1, seconds]
+        else:
+            span[0] += 1
+            span[1] += seconds
+
+def count(name, n=1):
+    counter_totals[name] = counter_totals.get(name, 0) + n
+    metrics = _request.get()
+    if metrics is not None:
+        metrics.counters[name] = metrics.counters.get(name, 0) + n
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def timed(name):
+    #decorator: a span around every call of the function, async or not
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def hit_ratios(counters):
+    #"cache.<name>.hits" and "cache.<name>.misses" -> {name: hits / lookups}
+    ratios = {}
+    for key, hits in counters.items():
+        if key.startswith("cache.") and key.endswith(".hits"):
+            name = key[len("cache."):-len(".hits")]
+            lookups = hits + counters.get(f"cache.{name}.misses", 0)
+            ratios[name] = round(hits / lookups, 4) if lookups else None
+    for key in counters:
+        if key.startswith("cache.") and key.endswith(".misses"):
+            ratios.setdefault(key[len("cache."):-len(".misses")], 0.0)
+    return ratios
+
+def stats():
+    return {
+        "requests": requests["count"],
+        "spans": {
+            name: {
+                "count": n,
+                "total_ms": round(seconds * 1000, 2),
+                "avg_ms": round(seconds * 1000 / n, 3),
+                "max_ms": round(longest * 1000, 2),
+            }
+            for name, (n, seconds, longest) in span_totals.items()
+        },
+        "counters": dict(counter_totals),
+        "cache_hit_ratio": hit_ratios(counter_totals),
+    }
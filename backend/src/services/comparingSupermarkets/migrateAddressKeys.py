@@ -0,0 +1,63 @@
+#one-off migration: re-key the address caches by address_key.
+#documents written before the canonical key used the address as typed, so the same
+#address can have several documents. for every new identity the newest document is
+#kept (re-keyed if needed) and the others are deleted.
+#usage: python migrateAddressKeys.py [--dry-run]
+from datetime import datetime
+from pymongo import DeleteMany, UpdateOne
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.db.index import get_db
+from addressKey import address_key
+
+#collection -> (address fields, the other identity fields)
+COLLECTIONS = {
+    "findStores": (["cart_address"], ["product_name"]),
+    "notFoundStores": (["cart_address"], ["productId"]),
+    "distances": (["from", "to"], []),
+    "geocodes": (["address"], []),
+}
+
+def newest_first(doc):
+    #documents without last_updated are the oldest
+    return doc.get("last_updated") or datetime.min
+
+def migrate_collection(collection, address_fields, other_fields, dry_run):
+    projection = {field: 1 for field in address_fields + other_fields + ["last_updated"]}
+    groups = {}
+    for doc in collection.find({}, projection):
+        if any(not isinstance(doc.get(field), str) for field in address_fields):
+            continue
+        identity = tuple(address_key(doc[field]) for field in address_fields) + \
+            tuple(doc.get(field) for field in other_fields)
+        groups.setdefault(identity, []).append(doc)
+
+    duplicates = []
+    updates = []
+    for identity, docs in groups.items():
+        docs.sort(key=newest_first, reverse=True)
+        keep = docs[0]
+        duplicates.extend(doc["_id"] for doc in docs[1:])
+        new_values = dict(zip(address_fields, identity))
+        if any(keep[field] != value for field, value in new_values.items()):
+            updates.append(UpdateOne({"_id": keep["_id"]}, {"$set": new_values}))
+
+    print(f"{collection.name}: {len(groups)} keys, {len(updates)} re-keyed, {len(duplicates)} duplicates deleted")
+    if dry_run:
+        return
+
+    #duplicates first, a re-keyed document may take the key of one of them (unique indexes)
+    for i in range(0, len(duplicates), 1000):
+        collection.bulk_write([DeleteMany({"_id": {"$in": duplicates[i:i + 1000]}})])
+    for i in range(0, len(updates), 1000):
+        collection.bulk_write(updates[i:i + 1000], ordered=False)
+
+def main(dry_run):
+    db = get_db()
+    for name, (address_fields, other_fields) in COLLECTIONS.items():
+        migrate_collection(db[name], address_fields, other_fields, dry_run)
+
+if __name__ == "__main__":
+    main("--dry-run" in sys.argv[1:])
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import OrderedDict
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+
+class TokenBucket:
+    #rate budget: tokens refill at rate per second up to burst.
+    #take() waits for a token, spend() takes one right away and may leave the bucket in debt
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def spend(self, tokens=1):
+        self._refill()
+        #the debt is bounded, a burst of user requests delays the refresher but never stops it
+        self.tokens = max(self.tokens - tokens, -self.burst)
+
+    async def take(self):
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+class AccessTracker:
+    #how often each (cart_key, product) is asked for, as a count that halves every half_life
+    #seconds. only the max_size most recently used keys are tracked
+    def __init__(self, max_size, half_life):
+        self.max_size = max_size
+        self.half_life = half_life
+        self._entries = OrderedDict()  #key -> [count, last access, shopping address]
+
+    def _decayed(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def touch(self, key, shopping_address, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(key)
+        count = self._decayed(entry, now) if entry is not None else 0
+        #the latest spelling of the address is the one CHP gets
+        self._entries[key] = [count + 1, now, shopping_address]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def hottest(self, min_count, now=None):
+        #[(count, key, shopping address)] of the keys asked for at least min_count times, hottest first
+        now = time.monotonic() if now is None else now
+        hot = []
+        for key, entry in self._entries.items():
+            count = self._decayed(entry, now)
+            if count >= min_count:
+                hot.append((count, key, entry[2]))
+        hot.sort(key=lambda item: item[0], reverse=True)
+        return hot
+
+    def __len__(self):
+        return len(self._entries)
+
+#every CHP request spends from the same budget: the refresher waits for tokens,
+#the requests of users never wait but leave less for the refresher
+chp_budget = TokenBucket(Config.CHP_RATE, Config.CHP_BURST)
+accesses = AccessTracker(Config.REFRESH_TRACKED_SIZE, Config.REFRESH_HALF_LIFE_HOURS * 60 * 60)
+refresh_counters = {"rounds": 0, "refreshed": 0, "failed": 0}
+
+def refresher_stats():
+    return {"tracked": len(accesses), "chp_tokens": round(chp_budget.tokens, 2), **refresh_counters}
+
+async def run(refresh_entry, expires_in):
+    #refresh_entry(cart_key, shopping_address, product) -> whether CHP answered
+    #expires_in(cart_key, product) -> seconds until the cached entry expires, None if not in memory
+    if Config.CHP_RATE <= 0:
+        return
+    ahead = Config.REFRESH_AHEAD_HOURS * 60 * 60
+    slots = asyncio.Semaphore(Config.REFRESH_CONCURRENCY)
+    refreshing = set()
+
+    async def refresh(key, shopping_address):
+        try:
+            async with slots:
+                if await refresh_entry(key[0], shopping_address, key[1]):
+                    refresh_counters["refreshed"] += 1
+                else:
+                    refresh_counters["failed"] += 1
+        except Exception:
+            #a failed refresh keeps the cached entry, the request path fetches it if it expires
+            refresh_counters["failed"] += 1
+        finally:
+            refreshing.discard(key)
+
+    tasks = set()
+    try:
+        while True:
+            await asyncio.sleep(Config.REFRESH_INTERVAL)
+            refresh_counters["rounds"] += 1
+            for count, key, shopping_address in accesses.hottest(Config.REFRESH_MIN_ACCESSES):
+                if key in refreshing:
+                    continue
+                remaining = expires_in(*key)
+                if remaining is None or remaining > ahead:
+                    continue
+                await chp_budget.take()
+                refreshing.add(key)
+                task = asyncio.create_task(refresh(key, shopping_address))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,59 @@
+import numpy as np
+
+#vectorized calculate_total_price (benchmarks/bench_pricing.py) over a stores x products matrix
+#regular, sale, required: float arrays shaped (stores, products), NaN where missing
+#quantities: the cart quantity of every product, shaped (products,)
+#returns the total price of every (store, product) pair
+def basket_totals(regular, sale, required, quantities):
+    regular = np.asarray(regular, dtype=float)
+    sale = np.asarray(sale, dtype=float)
+    required = np.asarray(required, dtype=float)
+    quantities = np.broadcast_to(np.asarray(quantities, dtype=float), regular.shape)
+
+    #no sale price or no required quantity -> regular price for every unit
+    has_discount = ~(np.isnan(sale) | np.isnan(required))
+    regular_total = regular * quantities
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        num_of_discount_groups = quantities // required  # times to use the discount
+        remaining_units = quantities % required  # times to use regular price
+        discount_total = (num_of_discount_groups * sale * required) + (remaining_units * regular)
+
+    return np.where(has_discount, discount_total, regular_total)
+
+def basket_price(totals):
+    #sum of every store's row, NaN when the store has no price at all (like sum(min_count=1))
+    known = ~np.isnan(totals)
+    return np.where(known.any(axis=1), np.where(known, totals, 0).sum(axis=1), np.nan)
+
+class PriceMatrix:
+    #compact comparison data of one cart: stores x products arrays instead of a wide DataFrame
+    #stores: list of (store name, store address), row i of every array
+    #products: list of product names, column j of every array
+    #regular, sale, required: float arrays, NaN where CHP had no value
+    #quantities: the cart quantity of every product
+    def __init__(self, stores, products, regular, sale, required, quantities):
+        self.stores = stores
+        self.products = products
+        self.store_index = {store: i for i, store in enumerate(stores)}
+        self.product_index = {product: j for j, product in enumerate(products)}
+        self.regular = regular
+        self.sale = sale
+        self.required = required
+        self.quantities = quantities
+
+    def __len__(self):
+        return len(self.stores)
+
+    @property
+    def addresses(self):
+        return [address for _, address in self.stores]
+
+    def totals(self):
+        return basket_totals(self.regular, self.sale, self.required, self.quantities)
+
+    def unit_prices(self):
+        #the price shown per product: the sale price once the cart reaches the required quantity
+        with np.errstate(invalid="ignore"):
+            use_sale = (self.required > 0) & (self.quantities >= self.required)
+        return np.where(use_sale, self.sale, self.regular)
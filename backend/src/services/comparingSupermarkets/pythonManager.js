@@ -6,6 +6,111 @@ const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
 let pythonProcess = null;
+let nextRequestId = 1;
+//request id -> { resolve, reject, onProgress } of the caller waiting for it
+const pending = new Map();
+
+//the channel starts as JSON lines; after the hello both sides switch to frames:
+//a 4 byte big-endian length, then the message as compact JSON
+let framed = false;
+//resolves once the hello is answered, requests wait for it
+let ready = Promise.resolve();
+
+const encode = (message) => {
+  if (framed) return Buffer.from(JSON.stringify(message), "utf-8");
+  return Buffer.from(JSON.stringify(message) + "\n", "utf-8");
+};
+
+const decode = (payload) => JSON.parse(payload.toString("utf-8"));
+
+const writeMessage = (message) => {
+  const body = encode(message);
+  if (!framed) {
+    pythonProcess.stdin.write(body);
+    return;
+  }
+  const header = Buffer.alloc(4);
+  header.writeUInt32BE(body.length, 0);
+  pythonProcess.stdin.write(Buffer.concat([header, body]));
+};
+
+const handleResponse = (parsed) => {
+  const { id, ...response } = parsed;
+  const waiting = pending.get(id);
+  if (!waiting) {
+    console.error("[Python stdout]: response without a waiting request:", parsed);
+    return;
+  }
+  //a streamed request gets its early rankings before the final response
+  if (response.stage && response.stage !== "final") {
+    waiting.onProgress?.(response);
+    return;
+  }
+  pending.delete(id);
+  waiting.resolve(response);
+};
+
+//stdout chunks are kept until a whole message arrived, they are joined once per message
+//instead of on every chunk
+let chunks = [];
+let buffered = 0;
+let needed = 1;
+
+const readMessages = (chunk) => {
+  chunks.push(chunk);
+  buffered += chunk.length;
+
+  while (buffered >= needed) {
+    const data = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, buffered);
+    let payload;
+    let rest;
+    if (!framed) {
+      const newline = data.indexOf(0x0a);
+      if (newline === -1) {
+        chunks = [data];
+        needed = buffered + 1;
+        return;
+      }
+      payload = data.subarray(0, newline);
+      rest = data.subarray(newline + 1);
+    } else {
+      const length = data.readUInt32BE(0);
+      if (data.length < 4 + length) {
+        chunks = [data];
+        needed = 4 + length;
+        return;
+      }
+      payload = data.subarray(4, 4 + length);
+      rest = data.subarray(4 + length);
+    }
+    chunks = rest.length ? [rest] : [];
+    buffered = rest.length;
+
+    if (framed || payload.toString("utf-8").trim()) {
+      try {
+        handleResponse(decode(payload));
+      } catch (error) {
+        console.error("[Python stdout]: bad message:", error.message);
+      }
+    }
+    //the hello response may have switched to frames
+    needed = framed ? 4 : 1;
+  }
+};
+
+//ask for frames, python answers whether it switches (frames: false keeps JSON lines)
+const negotiate = () =>
+  new Promise((resolve) => {
+    pending.set(0, {
+      resolve: (response) => {
+        framed = response.frames === true;
+        resolve();
+      },
+      //the process exited before answering, requests fail on their own
+      reject: () => resolve(),
+    });
+    writeMessage({ type: "hello", frames: true, id: 0 });
+  });
 
 //start the Python background server
 export const startPythonServer = () => {
@@ -21,57 +126,49 @@ export const startPythonServer = () => {
     },
   });
 
-  pythonProcess.stdout.setEncoding("utf-8");
   pythonProcess.stderr.setEncoding("utf-8");
 
   pythonProcess.stderr.on("data", (data) => {
     console.error("[Python stderr]:", data.trim());
   });
 
-  /*
-  pythonProcess.stdout.on("data", (data) => {
-    console.error("[Python stdout]:", data.trim());
-  });
-  */
+  //every response is tagged with the id of its request
+  framed = false;
+  chunks = [];
+  buffered = 0;
+  needed = 1;
+  pythonProcess.stdout.on("data", readMessages);
+
   pythonProcess.on("close", (code) => {
     console.log(`[Python process exited with code ${code}]`);
+    pythonProcess = null;
+
+    //nobody is going to answer the requests still waiting
+    for (const { reject } of pending.values()) {
+      reject(new Error("python server exited"));
+    }
+    pending.clear();
   });
 
+  ready = negotiate();
   console.log("Python server started");
 };
 
-//send a payload (JS object) to Python, receive back a parsed JSON response
-export const sendToPython = (payload) => {
+//send a payload (JS object) to Python, receive back the parsed response.
+//with onProgress, python streams: onProgress gets each early ranking
+//({ seq, stage: "provisional" | "refined", supermarkets }) and the promise resolves with the final one
+export const sendToPython = async (payload, onProgress = null) => {
+  await ready;
   return new Promise((resolve, reject) => {
     if (!pythonProcess) {
       return reject(new Error("python server is not running"));
     }
 
-    let buffer = "";
-
-    const onData = (data) => {
-      buffer += data.toString();
-
-      try {
-        //try to find complete JSON object inside the buffer
-        const jsonStart = buffer.indexOf("{");
-        const jsonEnd = buffer.lastIndexOf("}");
-
-        if (jsonStart !== -1 && jsonEnd !== -1 && jsonEnd > jsonStart) {
-          const completeJson = buffer.slice(jsonStart, jsonEnd + 1);
-          const parsed = JSON.parse(completeJson);
-
-          pythonProcess.stdout.off("data", onData);
-          resolve(parsed);
-        }
-      } catch (error) {
-        //still not a complete JSON, keep buffering
-      }
-    };
-
-    pythonProcess.stdout.on("data", onData);
+    //python answers requests as they finish, so the id matches the response back
+    const id = nextRequestId++;
+    pending.set(id, { resolve, reject, onProgress });
 
-    //send JSON line to Python
-    pythonProcess.stdin.write(JSON.stringify(payload) + "\n");
+    const request = onProgress ? { ...payload, stream: true, id } : { ...payload, id };
+    writeMessage(request);
   });
 };
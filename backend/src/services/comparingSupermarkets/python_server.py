@@ -1,21 +1,48 @@
 import sys
 import os
-import json
 import asyncio
-from bestBranches import get_best_supermarkets
+from bestBranches import (
+    get_best_supermarkets, get_best_supermarkets_batch, get_best_supermarkets_session,
+    rescore_session, session_stats,
+)
+from importPrices import cache_stats, fetch_stats, refresh_entry, entry_expires_in
+import httpClient
+import priceRefresher
+import metrics
+from geocodeStore import geocode_stats
+from spatialIndex import pruning_stats
+from upstream import upstream_stats
+import framing
+import supervisor
+import cpuPool
 
 base_dir = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "../../..")
 )
 sys.path.insert(0, base_dir)
+from src.config import Config
+
+#stdin/stdout, JSON lines until the client says hello
+channel = None
 
-async def process_request(data):
+async def process_request(data, on_progress=None):
     try:
         cart = data["cart"]
         address = data["address"]
         alpha = data.get("alpha", 0.5)
 
-        supermarkets, recommendations = await get_best_supermarkets(cart, address, alpha)
+        #"session": true keeps the comparison, a "rescore" request with its token ranks it for another alpha
+        if data.get("session"):
+            supermarkets, recommendations, token, frontier = await get_best_supermarkets_session(
+                cart, address, alpha, on_progress)
+            return {
+                "supermarkets": supermarkets,
+                "recommendations": recommendations,
+                "session": token,
+                "frontier": frontier,
+            }
+
+        supermarkets, recommendations = await get_best_supermarkets(cart, address, alpha, on_progress)
 
         return {
             "supermarkets": supermarkets,
@@ -24,22 +51,146 @@ async def process_request(data):
     except Exception as e:
         return {"error": str(e)}
 
+def process_rescore(data):
+    #{"session", "alpha", "cart", "address"} -> the response of the full request for alpha.
+    #"expired": true when the session is gone (or belongs to another cart), the caller compares again
+    try:
+        alpha = float(data["alpha"])
+        if not 0 <= alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1")
+        ranked = rescore_session(data["session"], alpha, data.get("cart"), data.get("address"))
+        if ranked is None:
+            return {"error": "session expired", "expired": True}
+        supermarkets, recommendations, frontier = ranked
+        return {
+            "supermarkets": supermarkets,
+            "recommendations": recommendations,
+            "session": data["session"],
+            "frontier": frontier,
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+async def process_batch(data):
+    #{"items": [{"cart", "address", "alpha"}]} -> {"results": [...]}, one result per item in order,
+    #each one what process_request returns for it
+    try:
+        items = data["items"]
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError("items must be a list of objects")
+        if len(items) > Config.BATCH_MAX_ITEMS:
+            raise ValueError(f"a batch has at most {Config.BATCH_MAX_ITEMS} items")
+        for item in items:
+            if "cart" not in item or "address" not in item:
+                raise ValueError("every item needs a cart and an address")
+
+        outcomes = await get_best_supermarkets_batch(items)
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                results.append({"error": str(outcome)})
+            else:
+                supermarkets, recommendations = outcome
+                results.append({"supermarkets": supermarkets, "recommendations": recommendations})
+        return {"results": results}
+    except Exception as e:
+        return {"error": str(e)}
+
+def get_stats():
+    return {
+        "caches": {**cache_stats(), "geocodes": geocode_stats(), "ranking_sessions": session_stats()},
+        "chp": fetch_stats(),
+        "upstream": upstream_stats(),
+        "cpu_pool": cpuPool.pool_stats(),
+        "distance_pruning": pruning_stats(),
+        "refresher": priceRefresher.refresher_stats(),
+        "metrics": metrics.stats(),
+    }
+
+def write_response(request_id, result):
+    #each response is one message, tagged with the id of the request it answers
+    if request_id is not None:
+        result = {"id": request_id, **result}
+    channel.write(result)
+
+async def handle_request(data, limiter):
+    if data.get("type") == "stats":
+        #answered right away, without waiting for a comparison slot
+        write_response(data.get("id"), get_stats())
+        return
+    if data.get("type") == "rescore":
+        #no pipeline to run, answered from memory
+        write_response(data.get("id"), process_rescore(data))
+        return
+
+    #streaming: every ranking is written as soon as it is ready, tagged with its position (seq),
+    #the last one has stage "final" and the recommendations
+    on_progress = None
+    seq = 0
+    if data.get("stream"):
+        async def on_progress(stage, supermarkets):
+            nonlocal seq
+            write_response(data.get("id"), {"seq": seq, "stage": stage, "supermarkets": supermarkets})
+            seq += 1
+
+    #the limiter caps how many comparisons run at the same time
+    async with limiter:
+        request_metrics = metrics.start_request()
+        if data.get("type") == "batch":
+            result = await process_batch(data)
+        else:
+            result = await process_request(data, on_progress)
+        timings = metrics.finish_request(request_metrics)
+    #"timings": true adds the spans and counters of this request to the response
+    if data.get("timings"):
+        result = {**result, "timings": timings}
+    if data.get("stream"):
+        result = {"seq": seq, "stage": "final", **result}
+    write_response(data.get("id"), result)
+
 async def main():
-    #listen for lines from stdin
+    global channel
+    channel = framing.Channel(await framing.open_stdin())
+    if Config.PYTHON_WORKERS > 1:
+        #the comparisons run in worker processes, this one only routes
+        await supervisor.run(channel, Config.PYTHON_WORKERS)
+        return
+    #the parse processes are warmed up before the first request is read. they come from a fork
+    #server, not from this process, which already has threads (the stdin reader, pymongo later on)
+    cpuPool.start()
+    limiter = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
+    running = set()
+    #one pooled HTTP client for every request of the process
+    await httpClient.start()
+    #keeps the popular products of every area fresh, off the request path
+    refresher = asyncio.create_task(priceRefresher.run(refresh_entry, entry_expires_in))
+
+    #listen for messages from stdin
     while True:
         try:
-            #read one line from stdin, decode safely
-            line = await asyncio.get_event_loop().run_in_executor(None, lambda: sys.stdin.buffer.readline().decode('utf-8', errors='replace'))
-            if not line:
+            data = await channel.read()
+            if data is None:
                 break
+        except Exception as e:
+            write_response(None, {"error": str(e)})
+            continue
 
-            data = json.loads(line.strip())
-            result = await process_request(data)
+        if data.get("type") == "hello":
+            channel.accept_hello(data)
+            continue
 
-        except Exception as e:
-            result = {"error": str(e)}
+        #run the request as a task so the next message is read right away
+        task = asyncio.create_task(handle_request(data, limiter))
+        running.add(task)
+        task.add_done_callback(running.discard)
 
-        print(json.dumps(result, ensure_ascii=False), flush=True)
+    #stdin closed: let the requests already in flight finish
+    if running:
+        await asyncio.gather(*running)
+    refresher.cancel()
+    await asyncio.gather(refresher, return_exceptions=True)
+    await httpClient.close()
+    cpuPool.shutdown()
 
 
 
@@ -0,0 +1,72 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+#grid cells of 0.05 degrees, about 5.5 km north-south and 4.7 km east-west in Israel
+CELL_DEGREES = 0.05
+
+def haversine_km(lat, lon, lats, lons):
+    #straight-line distance from one point to arrays of points
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+class BranchGrid:
+    #spatial index of the branch coordinates known so far: a grid of lat/lon cells,
+    #a radius query only measures the branches of the cells around the point
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.cells = {}  #(row, col) -> {address key: (lat, lon)}
+        self.coords = {}  #address key -> (lat, lon)
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees))
+
+    def __contains__(self, key):
+        return key in self.coords
+
+    def __len__(self):
+        return len(self.coords)
+
+    def clear(self):
+        self.cells.clear()
+        self.coords.clear()
+
+    def add(self, key, lat, lon):
+        old = self.coords.get(key)
+        if old == (lat, lon):
+            return
+        if old is not None:
+            self.cells.get(self._cell(*old), {}).pop(key, None)
+        self.coords[key] = (lat, lon)
+        self.cells.setdefault(self._cell(lat, lon), {})[key] = (lat, lon)
+
+    def within(self, lat, lon, radius_km):
+        #keys of the branches up to radius_km from (lat, lon)
+        lat_cells = math.ceil(radius_km / (111.32 * self.cell_degrees))
+        #longitude degrees get shorter away from the equator
+        lon_km = 111.32 * self.cell_degrees * max(math.cos(math.radians(lat + math.copysign(radius_km / 111.32, lat))), 0.01)
+        lon_cells = math.ceil(radius_km / lon_km)
+
+        row, col = self._cell(lat, lon)
+        keys, lats, lons = [], [], []
+        for r in range(row - lat_cells, row + lat_cells + 1):
+            for c in range(col - lon_cells, col + lon_cells + 1):
+                for key, (branch_lat, branch_lon) in self.cells.get((r, c), {}).items():
+                    keys.append(key)
+                    lats.append(branch_lat)
+                    lons.append(branch_lon)
+
+        if not keys:
+            return set()
+        distances = haversine_km(lat, lon, np.array(lats), np.array(lons))
+        return {key for key, distance in zip(keys, distances) if distance <= radius_km}
+
+#every branch geocoded so far, shared by all requests
+branch_grid = BranchGrid()
+pruning_counters = {"checked": 0, "pruned": 0}
+
+def pruning_stats():
+    #pruned: Distance Matrix elements that were never requested
+    return {"known_branches": len(branch_grid), **pruning_counters}
@@ -0,0 +1,53 @@
+from collections import Counter
+
+class CoverageIndex:
+    #which cart products every store sells, as one integer bitmask per store (bit j = products[j]).
+    #built once per request: "sells everything", "missing product X" and "would qualify
+    #without products S" are then bitwise operations instead of set differences per store
+    def __init__(self, store_lists, products):
+        self.products = list(products)
+        self.bit = {p: 1 << j for j, p in enumerate(self.products)}
+        self.full = (1 << len(self.products)) - 1
+
+        #(storeName, address) -> mask of the products it sells, in the order the stores were found
+        self.sold = {}
+        for p in self.products:
+            for store in store_lists.get(p, []):
+                store = tuple(store)
+                self.sold[store] = self.sold.get(store, 0) | self.bit[p]
+
+    def __len__(self):
+        return len(self.sold)
+
+    def mask_of(self, products):
+        mask = 0
+        for p in products:
+            mask |= self.bit.get(p, 0)
+        return mask
+
+    def missing_mask(self, store):
+        return self.full & ~self.sold.get(store, 0)
+
+    def stores_selling(self, mask):
+        return [store for store, sold in self.sold.items() if sold & mask == mask]
+
+    def stores_selling_all(self):
+        return self.stores_selling(self.full)
+
+    def stores_missing(self, product):
+        bit = self.bit[product]
+        return [store for store, sold in self.sold.items() if not sold & bit]
+
+    def stores_qualifying_without(self, removed_products):
+        return self.stores_selling(self.full & ~self.mask_of(removed_products))
+
+    def missing_counts(self):
+        #amount of stores per mask of missing products
+        return Counter(self.full & ~sold for sold in self.sold.values())
+
+    def problematic_products(self):
+        #products that at least one store does not sell, in cart order
+        missing = 0
+        for sold in self.sold.values():
+            missing |= self.full & ~sold
+        return [p for p in self.products if missing & self.bit[p]]
@@ -0,0 +1,255 @@
+import asyncio
+import itertools
+import os
+import sys
+import zlib
+
+import framing
+import cpuPool
+import metrics
+from addressKey import address_key
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+
+#supervisor mode of python_server (PYTHON_WORKERS > 1): the same stdin/stdout contract toward
+#pythonManager.js, the comparisons run in worker processes, each one a plain python_server.
+#a request goes to the worker of its address, so the caches of an area live in one process
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_server.py")
+#stats where the largest value of the workers is the one that means something
+MAXIMA = {"max_ms", "latency_ms"}
+
+def worker_environment(n_workers):
+    env = dict(os.environ)
+    env["PYTHON_WORKERS"] = "1"
+    #budgets that are kept per process: every worker gets its share, so the total toward CHP
+    #and Nominatim stays what it is with one process
+    env["CHP_RATE"] = str(Config.CHP_RATE / n_workers)
+    env["NOMINATIM_MIN_INTERVAL"] = str(Config.NOMINATIM_MIN_INTERVAL * n_workers)
+    #and so do the concurrency caps of the upstream limiters, the connections follow them
+    chp_max = max(1, Config.CHP_MAX_CONCURRENCY // n_workers)
+    env["CHP_MAX_CONCURRENCY"] = str(chp_max)
+    env["CHP_INITIAL_CONCURRENCY"] = str(min(chp_max, max(1, Config.CHP_INITIAL_CONCURRENCY // n_workers)))
+    env["DISTANCE_MATRIX_MAX_CONCURRENCY"] = str(max(1, Config.DISTANCE_MATRIX_MAX_CONCURRENCY // n_workers))
+    #the cores are shared too, so the parse pools together have one process per core
+    env["PARSE_WORKERS"] = str(max(1, cpuPool.parse_workers() // n_workers))
+    return env
+
+class Worker:
+    def __init__(self, index, env):
+        self.index = index
+        self.env = env
+        self.process = None
+        self.channel = None
+        self.live = False
+        self.in_flight = set()  #ids of the requests sent to it and not answered yet
+        self.routed = 0
+        self.restarts = 0
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, SERVER,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self.env,
+            limit=framing.LINE_LIMIT,
+        )
+        self.channel = framing.Channel(self.process.stdout, self.process.stdin)
+        try:
+            await self.channel.offer_hello()
+        except BaseException:
+            if self.process.returncode is None:
+                self.process.kill()
+            await self.process.wait()
+            raise
+        self.live = True
+
+    def send(self, message):
+        self.in_flight.add(message.get("id"))
+        self.channel.write(message)
+
+    def info(self):
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "live": self.live,
+            "in_flight": len(self.in_flight),
+            "routed": self.routed,
+            "restarts": self.restarts,
+        }
+
+def merge_stats(a, b, key=None):
+    #the stats of two workers as one: counts add up, maxima are the larger one
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, dict) and isinstance(b, dict):
+        return {k: merge_stats(a.get(k), b.get(k), k) for k in dict.fromkeys([*a, *b])}
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return max(a, b) if key in MAXIMA else a + b
+    return a
+
+def recompute_ratios(stats):
+    #ratios and averages do not add up, they are computed again from the summed counts
+    if not isinstance(stats, dict):
+        return stats
+    for value in stats.values():
+        recompute_ratios(value)
+    if "hit_ratio" in stats:
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        stats["hit_ratio"] = stats.get("hits", 0) / lookups if lookups else None
+    if "avg_ms" in stats:
+        stats["avg_ms"] = round(stats["total_ms"] / stats["count"], 3) if stats.get("count") else None
+    if "cache_hit_ratio" in stats and "counters" in stats:
+        stats["cache_hit_ratio"] = metrics.hit_ratios(stats["counters"])
+    return stats
+
+class Supervisor:
+    def __init__(self, channel, n_workers):
+        self.channel = channel
+        env = worker_environment(n_workers)
+        self.workers = [Worker(i, env) for i in range(n_workers)]
+        self.pending = {}  #id of a request of the supervisor itself -> future of the answer
+        self.ids = itertools.count()
+        self.closing = False
+
+    def route(self, data):
+        #the worker of the address (of the first item of a batch), or the next live one while it restarts
+        address = data.get("address")
+        items = data.get("items")
+        if address is None and isinstance(items, list) and items and isinstance(items[0], dict):
+            address = items[0].get("address")
+        if isinstance(address, str):
+            start = zlib.crc32(address_key(address).encode("utf-8")) % len(self.workers)
+        else:
+            start = next(self.ids) % len(self.workers)
+        for i in range(len(self.workers)):
+            worker = self.workers[(start + i) % len(self.workers)]
+            if worker.live:
+                return worker
+        return None
+
+    def forward(self, data):
+        worker = self.route(data)
+        if worker is None:
+            self.reply(data.get("id"), {"error": "no python worker is running"})
+            return
+        worker.routed += 1
+        worker.send(data)
+
+    def reply(self, request_id, result):
+        if request_id is not None:
+            result = {"id": request_id, **result}
+        self.channel.write(result)
+
+    def from_worker(self, worker, message):
+        request_id = message.get("id")
+        stage = message.get("stage")
+        #a streamed request is answered once its final stage arrived
+        if stage is None or stage == "final":
+            worker.in_flight.discard(request_id)
+        future = self.pending.pop(request_id, None)
+        if future is not None:
+            if not future.done():
+                future.set_result(message)
+            return
+        self.channel.write(message)
+
+    def worker_exited(self, worker):
+        worker.live = False
+        for request_id in worker.in_flight:
+            future = self.pending.pop(request_id, None)
+            if future is not None:
+                future.set_result(None)
+            elif request_id is not None:
+                self.reply(request_id, {"error": "python worker exited"})
+        worker.in_flight.clear()
+
+    async def serve_worker(self, worker):
+        #reads the answers of one worker, starts it again whenever it exits
+        while True:
+            if worker.live:
+                while True:
+                    try:
+                        message = await worker.channel.read()
+                    except ValueError as e:
+                        print(f"worker {worker.index}: {e}", file=sys.stderr, flush=True)
+                        continue
+                    if message is None:
+                        break
+                    self.from_worker(worker, message)
+                await worker.process.wait()
+                self.worker_exited(worker)
+                if self.closing:
+                    return
+                print(f"worker {worker.index} exited with code {worker.process.returncode}",
+                      file=sys.stderr, flush=True)
+
+            await asyncio.sleep(Config.WORKER_RESTART_DELAY)
+            worker.restarts += 1
+            try:
+                await worker.start()
+            except (OSError, ConnectionError, ValueError) as e:
+                print(f"worker {worker.index} did not start: {e}", file=sys.stderr, flush=True)
+
+    async def stats(self, request_id):
+        futures = []
+        for worker in self.workers:
+            if not worker.live:
+                futures.append(None)
+                continue
+            internal_id = f"stats:{next(self.ids)}"
+            future = self.pending[internal_id] = asyncio.get_running_loop().create_future()
+            worker.send({"type": "stats", "id": internal_id})
+            futures.append(future)
+
+        reports = []
+        for future in futures:
+            report = await future if future is not None else None
+            reports.append({k: v for k, v in report.items() if k != "id"} if report else None)
+
+        total = None
+        for report in reports:
+            total = merge_stats(total, report)
+        result = recompute_ratios(total or {})
+        result["workers"] = [{**worker.info(), "stats": report} for worker, report in zip(self.workers, reports)]
+        self.reply(request_id, result)
+
+    async def run(self):
+        await asyncio.gather(*(worker.start() for worker in self.workers), return_exceptions=True)
+        serving = [asyncio.create_task(self.serve_worker(worker)) for worker in self.workers]
+        running = set()
+
+        while True:
+            try:
+                data = await self.channel.read()
+                if data is None:
+                    break
+            except Exception as e:
+                self.reply(None, {"error": str(e)})
+                continue
+
+            if data.get("type") == "hello":
+                self.channel.accept_hello(data)
+            elif data.get("type") == "stats":
+                task = asyncio.create_task(self.stats(data.get("id")))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            else:
+                self.forward(data)
+
+        #stdin closed: the workers finish the requests they have and exit
+        self.closing = True
+        for worker in self.workers:
+            if worker.live:
+                worker.process.stdin.close()
+        if running:
+            await asyncio.gather(*running)
+        for task, worker in zip(serving, self.workers):
+            if not worker.live:
+                task.cancel()
+        await asyncio.gather(*serving, return_exceptions=True)
+
+async def run(channel, n_workers):
+    await Supervisor(channel, n_workers).run()
@@ -0,0 +1,75 @@
+#recommendations of get_store_data when a store_filter drops branches before they are priced
+#usage: python -m pytest tests (from comparingSupermarkets)
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "benchmarks")))
+#the db client connects lazily, nothing is read from it here
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+import httpClient
+import importPrices
+from addressKey import address_key
+from memory_db import MemoryDb
+from pymongo import UpdateOne
+
+ADDRESS = "הרצל 1, תל אביב"
+CART = {"p1": 1, "p2": 1, "p3": 1}
+
+def setup_area(monkeypatch, stores):
+    #stores: (name, address) -> the products it sells, all in findStores and findPrices
+    memory = MemoryDb(latency_ms=0).install()
+    importPrices.stores_cache.clear()
+    importPrices.prices_cache.clear()
+    cart_key = address_key(ADDRESS)
+    for p in CART:
+        memory.find_stores[(cart_key, p)] = {
+            "cart_address": cart_key,
+            "product_name": p,
+            "stores": [store for store, products in stores.items() if p in products],
+        }
+    memory.find_prices.clear()
+    for (sn, addr), products in stores.items():
+        for p in products:
+            op = UpdateOne(
+                {"product_name": p, "store_name": sn, "store_address": addr},
+                {"$set": {"regular_price": 10.0, "sale_price": None, "required_quantity": 1}},
+                upsert=True,
+            )
+            memory._upsert(memory.find_prices, (p, sn, addr), op)
+
+    async def no_session():
+        return None
+    monkeypatch.setattr(httpClient, "get_session", no_session)
+
+def run(store_filter):
+    return asyncio.run(importPrices.get_store_data(ADDRESS, CART, store_filter=store_filter))
+
+def test_far_full_cart_stores_do_not_trigger_removals(monkeypatch):
+    #six stores sell the whole cart but are all too far, the ones nearby miss a product
+    stores = {(f"far {i}", f"רחוב {i}, חיפה"): {"p1", "p2", "p3"} for i in range(6)}
+    stores[("near", "הרצל 3, תל אביב")] = {"p1", "p3"}
+    stores[("near too", "הרצל 5, תל אביב")] = {"p1", "p2"}
+    setup_area(monkeypatch, stores)
+
+    async def drop_far(selling):
+        return [s for s in selling if not s[0].startswith("far")]
+
+    price_matrix, recommended_removals = run(drop_far)
+    assert len(price_matrix) == 0
+    assert recommended_removals == []
+
+def test_removal_recommended_when_few_stores_sell_the_cart(monkeypatch):
+    #one store sells the whole cart, five more would with p2 removed
+    stores = {("full", "הרצל 2, תל אביב"): {"p1", "p2", "p3"}}
+    stores.update({(f"partial {i}", f"הרצל {10 + i}, תל אביב"): {"p1", "p3"} for i in range(5)})
+    stores[("no p3", "הרצל 4, תל אביב")] = {"p1", "p2"}
+    setup_area(monkeypatch, stores)
+
+    async def keep_all(selling):
+        return selling
+
+    price_matrix, recommended_removals = run(keep_all)
+    assert len(price_matrix) == 1
+    assert recommended_removals == ["p2"]
@@ -0,0 +1,71 @@
+#the early rankings of get_store_data while the CHP price pages land one by one
+#usage: python -m pytest tests (from comparingSupermarkets)
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "benchmarks")))
+#the db client connects lazily, nothing is read from it here
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+import httpClient
+import importPrices
+from addressKey import address_key
+from memory_db import MemoryDb
+from pymongo import UpdateOne
+
+ADDRESS = "הרצל 1, תל אביב"
+CART = {"p1": 1, "p2": 1, "p3": 1}
+STORE_A = ("a", "הרצל 2, תל אביב")
+STORE_B = ("b", "הרצל 4, תל אביב")
+#the database has every price but p2 of store a and p3 of store b
+IN_DB = {STORE_A: {"p1", "p3"}, STORE_B: {"p1", "p2"}}
+#seconds until the CHP page of a product lands
+PAGE_DELAY = {"p2": 0.01, "p3": 0.1}
+
+def setup_area(monkeypatch):
+    memory = MemoryDb(latency_ms=0).install()
+    importPrices.stores_cache.clear()
+    importPrices.prices_cache.clear()
+    cart_key = address_key(ADDRESS)
+    for p in CART:
+        memory.find_stores[(cart_key, p)] = {"cart_address": cart_key, "product_name": p, "stores": [STORE_A, STORE_B]}
+    for (sn, addr), products in IN_DB.items():
+        for p in products:
+            op = UpdateOne(
+                {"product_name": p, "store_name": sn, "store_address": addr},
+                {"$set": {"regular_price": 10.0, "sale_price": None, "required_quantity": None}},
+                upsert=True,
+            )
+            memory._upsert(memory.find_prices, (p, sn, addr), op)
+
+    async def no_session():
+        return None
+
+    async def fetch_store_data(session, product_name, shopping_address, prepaid=False):
+        await asyncio.sleep(PAGE_DELAY[product_name])
+        price = {"Regular Price": 12.0, "Sale Price": None, "Required Quantity": None}
+        return {STORE_A: dict(price), STORE_B: dict(price)}
+
+    monkeypatch.setattr(httpClient, "get_session", no_session)
+    monkeypatch.setattr(importPrices, "fetch_store_data", fetch_store_data)
+    return memory
+
+def test_refined_ranking_as_pages_land(monkeypatch):
+    memory = setup_area(monkeypatch)
+    stages = []
+
+    async def on_partial(price_matrix, stage):
+        stages.append((stage, sorted(price_matrix.stores)))
+
+    price_matrix, _ = asyncio.run(importPrices.get_store_data(ADDRESS, CART, on_partial))
+    #p2 lands first and completes store a, the last page is only in the full matrix
+    assert stages == [("refined", [STORE_A])]
+    assert sorted(price_matrix.stores) == [STORE_A, STORE_B]
+    #the fetched prices are still written in one round trip
+    assert ("p2",) + STORE_A in memory.find_prices and ("p3",) + STORE_B in memory.find_prices
+
+def test_no_early_ranking_without_a_listener(monkeypatch):
+    setup_area(monkeypatch)
+    price_matrix, _ = asyncio.run(importPrices.get_store_data(ADDRESS, CART))
+    assert len(price_matrix) == 2
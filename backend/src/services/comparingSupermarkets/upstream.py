@@ -0,0 +1,166 @@
+import asyncio
+import random
+import time
+from collections import deque
+import aiohttp
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../")))
+from src.config import Config
+import metrics
+
+#statuses that mean "not now": retried after a backoff, and a sign to send less
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TransientError(Exception):
+    #the upstream did not answer after every retry, nothing is known about the request
+    pass
+
+class AdaptiveLimiter:
+    #concurrency limit of one upstream, AIMD: one more slot per limit successful answers while the
+    #latency stays under the target, half the slots on throttling, errors or a slow latency
+    #(at most once per cooldown, a burst of failures of the same moment halves it once)
+    def __init__(self, name, initial, minimum, maximum, latency_target, min_interval=0, cooldown=1.0):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.min_interval = min_interval  #seconds between request starts, for rate-limited APIs
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.latency = None  #moving average, seconds
+        self._waiters = deque()
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+        self.counters = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "decreases": 0}
+
+    def _free(self):
+        return max(int(self.limit), 1) - self.in_flight
+
+    def _wake(self):
+        for _ in range(min(self._free(), len(self._waiters))):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def acquire(self):
+        #returns holding a slot, or raises (cancelled) without one
+        while self._free() <= 0:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+        if self.min_interval:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+            if start > now:
+                try:
+                    await asyncio.sleep(start - now)
+                except asyncio.CancelledError:
+                    self.release()
+                    raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def succeeded(self, latency):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.latency > self.latency_target:
+            self.decrease()
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def failed(self, throttled):
+        self.counters["throttled" if throttled else "errors"] += 1
+        self.decrease()
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        self.counters["decreases"] += 1
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+            **self.counters,
+        }
+
+#one limiter per upstream host
+LIMITERS = {
+    "chp": AdaptiveLimiter(
+        "chp", Config.CHP_INITIAL_CONCURRENCY, 2, Config.CHP_MAX_CONCURRENCY, Config.CHP_LATENCY_TARGET),
+    "distance_matrix": AdaptiveLimiter(
+        "distance_matrix", 10, 2, Config.DISTANCE_MATRIX_MAX_CONCURRENCY, 2.0),
+    #the usage policy of nominatim.openstreetmap.org: at most one request per second
+    "nominatim": AdaptiveLimiter(
+        "nominatim", 1, 1, Config.NOMINATIM_MAX_CONCURRENCY, 2.0, min_interval=Config.NOMINATIM_MIN_INTERVAL),
+    "google_maps": AdaptiveLimiter("google_maps", 4, 1, 10, 2.0),
+}
+
+def upstream_stats():
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
+
+def backoff(attempt, retry_after=None):
+    #full jitter: a random wait up to the exponential bound, so retries of many requests spread out
+    delay = random.uniform(0, min(Config.UPSTREAM_BACKOFF_MAX, Config.UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, Config.UPSTREAM_BACKOFF_MAX))
+    return delay
+
+def retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+async def get(session, upstream, url, params=None, headers=None, read="text"):
+    #GET through the limiter of upstream, (status, body) of the first answer that is not a retry status.
+    #read: "text" or "json". raises TransientError when every attempt failed
+    limiter = LIMITERS[upstream]
+    retry_after = None  #of the last answer with a retry status
+    for attempt in range(Config.UPSTREAM_RETRIES + 1):
+        if attempt:
+            limiter.counters["retries"] += 1
+            metrics.count(f"upstream.{upstream}.retries")
+            await asyncio.sleep(backoff(attempt - 1, retry_after))
+            retry_after = None
+
+        await limiter.acquire()
+        start = time.monotonic()
+        try:
+            limiter.counters["requests"] += 1
+            async with session.get(url, params=params, headers=headers) as response:
+                if response.status in RETRY_STATUSES:
+                    retry_after = retry_after_seconds(response)
+                    limiter.failed(throttled=response.status == 429)
+                    continue
+                if read == "json":
+                    body = await response.json(content_type=None)
+                else:
+                    body = await response.text()
+                limiter.succeeded(time.monotonic() - start)
+                return response.status, body
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            limiter.failed(throttled=False)
+        finally:
+            limiter.release()
+
+    metrics.count(f"upstream.{upstream}.failed")
+    raise TransientError(f"{upstream}: no answer after {Config.UPSTREAM_RETRIES + 1} attempts")
@@ -3,6 +3,7 @@ import { load } from "cheerio";
 import findStores from "../../models/FindStores.js";
 import findPrices from "../../models/FindPrices.js";
 import NotFoundStores from "../../models/NotFoundStores.js";
+import { addressKey } from "../comparingSupermarkets/addressKey.js";
 
 function parseDiscountText(discount_text) {
   let required_quantity = 1;
@@ -75,14 +76,16 @@ async function fetchCHPStores(productName, shoppingAddress) {
 export async function filterAvailableProducts(products, cartAddress) {
   const productNames = products.map((p) => p.name);
   const productIds = products.map((p) => p._id.toString());
+  //findStores and NotFoundStores are keyed by the canonical address, CHP gets it as typed
+  const cartAddressKey = addressKey(cartAddress);
 
   const [storeEntries, notFoundEntries] = await Promise.all([
     findStores.find({
-      cart_address: cartAddress,
+      cart_address: cartAddressKey,
       product_name: { $in: productNames },
     }),
     NotFoundStores.find({
-      cart_address: cartAddress,
+      cart_address: cartAddressKey,
       productId: { $in: productIds },
     }),
   ]);
@@ -125,7 +128,7 @@ export async function filterAvailableProducts(products, cartAddress) {
         availableProducts.push([productId, sellingStores.length]);
         //update findStores later with the info
         missingStoresEntries.push({
-          cart_address: cartAddress,
+          cart_address: cartAddressKey,
           product_name: name,
           stores: sellingStores.map((s) => [s.storeName, s.storeAddress]),
           last_updated: new Date(),
@@ -145,7 +148,7 @@ export async function filterAvailableProducts(products, cartAddress) {
       } else {
         //update NotFoundStores later with the info
         notFoundToInsert.push({
-          cart_address: cartAddress,
+          cart_address: cartAddressKey,
           product_name: name,
           productId: p._id.toString(),
           last_updated: new Date(),
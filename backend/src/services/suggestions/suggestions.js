@@ -11,6 +11,7 @@ import NotFoundStores from "../../models/NotFoundStores.js";
 import { filterAvailableProducts } from "./availableProducts.js";
 import { fetchFeaturesSuggestions } from "./features.js";
 import { rankProducts } from "./predictPurchases.js";
+import { addressKey } from "../comparingSupermarkets/addressKey.js";
 
 export function cleanAddress(address) {
   address = address.trim();
@@ -81,7 +82,7 @@ export async function getFilteredProducts(cartKey, mail, k, onRound) {
     Favorite.find({ mail })
       .lean()
       .then((favs) => new Set(favs.map((f) => f.productId.toString()))),
-    NotFoundStores.find({ cart_address: cartAddress }).then((entries) =>
+    NotFoundStores.find({ cart_address: addressKey(cartAddress) }).then((entries) =>
       entries.map((e) => e.productId)
     ),
   ]);
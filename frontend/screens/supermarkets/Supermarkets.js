@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import {
   View,
   Text,
@@ -31,6 +31,8 @@ const Supermarkets = ({ route }) => {
   const navigation = useNavigation();
   const [alpha, setAlpha] = useState(0.5);
   const [thumbPosition, setThumbPosition] = useState(SLIDER_WIDTH / 2);
+  //the comparison of this cart on the server, moving the slider only ranks it again
+  const sessionRef = useRef(null);
 
   const [isPopupVisible, setIsPopupVisible] = useState(false);
 
@@ -64,10 +66,9 @@ const Supermarkets = ({ route }) => {
 
       const newAlpha =
         closestSnap === 0 ? 0.25 : closestSnap === 0.5 ? 0.5 : 0.75;
+      //the alpha effect fetches the new ranking
       setAlpha(newAlpha);
       setThumbPosition(closestSnap * SLIDER_WIDTH);
-
-      fetchSupermarketBranches(newAlpha);
     },
   });
 
@@ -78,6 +79,7 @@ const Supermarkets = ({ route }) => {
     const info = {
       address: address,
       alpha: selectedAlpha,
+      ...(sessionRef.current && { session: sessionRef.current }),
     };
 
     try {
@@ -86,6 +88,7 @@ const Supermarkets = ({ route }) => {
       const data = response.data;
       if (response.status == 200) {
         const data = response.data;
+        sessionRef.current = data.session || null;
 
         if (!data.supermarkets || data.supermarkets.length === 0) {
           setSupermarketBranches([]);